@@ -0,0 +1,193 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Generates synthetic zendesk__ticket_metrics and zendesk__sla_policies datasets with the same columns as
+# the Dunder Mifflin sample files, at any size, for benchmarking the data path. The warehouse layout writes
+# the dbt model columns instead, as Parquet snapshots for the DuckDB destination.
+#
+#   python -m benchmarks.generate_data --rows 1000000 --out bench_data --format parquet
+#   python -m benchmarks.generate_data --rows 1000000 --out bench_data/warehouse --format parquet --layout warehouse
+
+ticket_file = 'zendesk__ticket_metrics'
+sla_file = 'zendesk__sla_policies'
+
+# Dimension cardinalities and skew (zipf exponent). Organizations and assignees are long tailed.
+dimensions = {
+    'ticket_group': (60, 1.1),
+    'ticket_brand': (4, 1.5),
+    'ticket_form': (25, 1.2),
+    'requester_organization': (20000, 1.05),
+    'assignee_name': (1500, 0.9),
+    'sla_policy_name': (12, 1.3)
+}
+channels = (['web', 'email', 'api', 'chat', 'voice', 'mobile', 'twitter', 'facebook'], [0.35, 0.3, 0.12, 0.1, 0.06, 0.04, 0.02, 0.01])
+statuses = (['new', 'open', 'pending', 'hold', 'solved', 'closed'], [0.05, 0.15, 0.08, 0.02, 0.3, 0.4])
+priorities = (['low', 'normal', 'high', 'urgent', None], [0.2, 0.5, 0.15, 0.05, 0.1])
+types = (['question', 'incident', 'problem', 'task', None], [0.4, 0.3, 0.1, 0.1, 0.1])
+submitter_roles = (['end-user', 'agent', 'admin'], [0.85, 0.13, 0.02])
+satisfaction_scores = (['good', 'bad', 'offered', None], [0.25, 0.05, 0.2, 0.5])
+metrics = (['first_reply_time', 'next_reply_time', 'requester_wait_time', 'agent_work_time'], [0.4, 0.3, 0.2, 0.1])
+# Relative ticket volume by weekday (Monday first) and by hour of day.
+weekday_weights = np.array([1.2, 1.15, 1.1, 1.05, 1.0, 0.35, 0.3])
+hour_weights = np.array([1, 1, 1, 1, 1, 2, 4, 7, 10, 12, 12, 11, 10, 11, 12, 11, 10, 8, 6, 4, 3, 2, 2, 1], dtype=float)
+
+# Sample file column -> dbt model column, for the warehouse layout.
+warehouse_ticket_columns = {
+    'ticket_brand': 'ticket_brand_name',
+    'ticket_channel': 'created_channel',
+    'ticket_form': 'ticket_form_name',
+    'ticket_group': 'group_name',
+    'ticket_priority': 'priority',
+    'ticket_type': 'type',
+    'requester_organization': 'requester_organization_name'
+}
+# The SLA model only holds the SLA columns, the ticket dimensions come from joining the ticket model.
+ticket_dimension_columns = ['ticket_group', 'ticket_brand', 'ticket_form', 'requester_organization', 'ticket_channel']
+
+def warehouse_ticket_chunk(tickets):
+    updated = tickets['first_solved_at'].fillna(tickets['created_at']).rename('updated_at')
+    return pd.concat([tickets.drop(columns='created_timestamp'), updated], axis=1).rename(columns=warehouse_ticket_columns)
+
+def warehouse_sla_chunk(slas):
+    return slas.drop(columns=ticket_dimension_columns)
+
+def zipf_weights(n, s):
+    weights = 1 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+def choose(rng, size, options):
+    values, weights = options
+    return np.array(values, dtype=object)[rng.choice(len(values), size=size, p=np.array(weights) / sum(weights))]
+
+def choose_dimension(rng, size, column):
+    n, s = dimensions[column]
+    label = column.replace('ticket_', '').replace('_name', '').replace('_', ' ').title()
+    return np.char.add(label + ' ', rng.choice(n, size=size, p=zipf_weights(n, s)).astype(str)).astype(object)
+
+def random_timestamps(rng, size, end, days):
+    day_range = pd.date_range(end=end, periods=days, freq='D')
+    day_weights = weekday_weights[day_range.dayofweek] * np.linspace(0.5, 1.5, days)  # volume grows over time
+    day = rng.choice(days, size=size, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, size=size, p=hour_weights / hour_weights.sum())
+    seconds = hour * 3600 + rng.integers(0, 3600, size=size)
+    return day_range.values[day] + seconds.astype('timedelta64[s]')
+
+def ticket_chunk(rng, first_id, size, end, days):
+    created = random_timestamps(rng, size, end, days)
+    status = choose(rng, size, statuses)
+    touches = rng.choice(3, size=size, p=[0.2, 0.25, 0.55])
+    first_reply = rng.lognormal(4, 1.5, size)
+    resolution = rng.lognormal(7, 1.6, size)
+    assignment = resolution * rng.uniform(0.5, 1, size)
+    solved = np.isin(status, ['solved', 'closed'])
+    first_solved = pd.Series(created + resolution.astype('timedelta64[m]')).where(solved)
+    return pd.DataFrame({
+        'ticket_id': np.arange(first_id, first_id + size),
+        'created_at': created,
+        'created_timestamp': created,
+        'status': status,
+        'first_solved_at': first_solved,
+        'ticket_brand': choose_dimension(rng, size, 'ticket_brand'),
+        'ticket_channel': choose(rng, size, channels),
+        'ticket_form': choose_dimension(rng, size, 'ticket_form'),
+        'ticket_group': choose_dimension(rng, size, 'ticket_group'),
+        'ticket_priority': choose(rng, size, priorities),
+        'ticket_type': choose(rng, size, types),
+        'submitter_role': choose(rng, size, submitter_roles),
+        'requester_organization': choose_dimension(rng, size, 'requester_organization'),
+        'is_one_touch_resolution': solved & (touches == 0),
+        'is_two_touch_resolution': solved & (touches == 1),
+        'is_multi_touch_resolution': solved & (touches == 2),
+        'first_assignment_to_resolution_calendar_minutes': np.where(solved, np.round(assignment), np.nan),
+        'requester_wait_time_in_calendar_minutes': np.round(resolution * rng.uniform(0.1, 0.9, size)),
+        'ticket_satisfaction_score': choose(rng, size, satisfaction_scores),
+        'first_reply_time_calendar_minutes': np.round(first_reply, 2),
+        'last_assignment_to_resolution_calendar_minutes': np.where(solved, np.round(assignment * rng.uniform(0.6, 1, size)), np.nan),
+        'final_resolution_calendar_minutes': np.where(solved, np.round(resolution), np.nan),
+        'assignee_name': choose_dimension(rng, size, 'assignee_name')
+    })
+
+def sla_chunk(rng, first_id, tickets):
+    # Each ticket gets zero to three SLA events, and inherits the ticket dimensions like the warehouse join.
+    counts = rng.choice(4, size=len(tickets), p=[0.55, 0.25, 0.15, 0.05])
+    rows = tickets.loc[tickets.index.repeat(counts)].reset_index(drop=True)
+    size = len(rows)
+    target = rng.choice([60, 120, 480, 1440], size=size, p=[0.4, 0.3, 0.2, 0.1])
+    applied = rows['created_at'].values + rng.integers(0, 120, size=size).astype('timedelta64[m]')
+    elapsed = np.round(target * rng.lognormal(-0.6, 0.7, size))
+    active = rng.random(size) < 0.08
+    return pd.DataFrame({
+        'sla_event_id': np.arange(first_id, first_id + size),
+        'ticket_id': rows['ticket_id'].values,
+        'sla_policy_name': choose_dimension(rng, size, 'sla_policy_name'),
+        'metric': choose(rng, size, metrics),
+        'sla_applied_at': applied,
+        'target': target,
+        'in_business_hours': rng.random(size) < 0.3,
+        'sla_breach_at': applied + target.astype('timedelta64[m]'),
+        'sla_elapsed_time': elapsed,
+        'is_active_sla': active,
+        'is_sla_breach': ~active & (elapsed > target),
+        'ticket_group': rows['ticket_group'].values,
+        'ticket_brand': rows['ticket_brand'].values,
+        'ticket_form': rows['ticket_form'].values,
+        'requester_organization': rows['requester_organization'].values,
+        'ticket_channel': rows['ticket_channel'].values
+    })
+
+class ChunkWriter:
+    # Appends chunks to one CSV or Parquet file so large datasets never have to fit in memory at once.
+    def __init__(self, path, file_format):
+        self.path = path
+        self.file_format = file_format
+        self.writer = None
+
+    def write(self, chunk):
+        if self.file_format == 'csv':
+            chunk.to_csv(self.path, mode='a' if self.writer else 'w', header=self.writer is None, index=False)
+            self.writer = True
+        else:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.file_format == 'parquet' and self.writer is not None:
+            self.writer.close()
+
+def generate(rows, out, file_format='csv', days=1095, end='2024-06-30', chunk_size=500000, seed=42, layout='sample'):
+    os.makedirs(out, exist_ok=True)
+    ticket_writer = ChunkWriter(os.path.join(out, ticket_file + '.' + file_format), file_format)
+    sla_writer = ChunkWriter(os.path.join(out, sla_file + '.' + file_format), file_format)
+    sla_id = 1
+    for i, first in enumerate(range(0, rows, chunk_size)):
+        rng = np.random.default_rng([seed, i])
+        tickets = ticket_chunk(rng, first + 1, min(chunk_size, rows - first), end, days)
+        slas = sla_chunk(rng, sla_id, tickets)
+        sla_id += len(slas)
+        if layout == 'warehouse':
+            tickets, slas = warehouse_ticket_chunk(tickets), warehouse_sla_chunk(slas)
+        ticket_writer.write(tickets)
+        sla_writer.write(slas)
+    ticket_writer.close()
+    sla_writer.close()
+    return ticket_writer.path, sla_writer.path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic Zendesk ticket and SLA datasets.')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of tickets (SLA events are about 0.7 per ticket).')
+    parser.add_argument('--out', default='bench_data', help='Output directory.')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--days', type=int, default=1095, help='Length of the ticket history in days.')
+    parser.add_argument('--end', default='2024-06-30', help='Last day of the ticket history.')
+    parser.add_argument('--chunk-size', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--layout', choices=['sample', 'warehouse'], default='sample', help='Sample file columns, or the dbt model columns read by the DuckDB destination.')
+    args = parser.parse_args()
+    for path in generate(args.rows, args.out, args.format, args.days, args.end, args.chunk_size, args.seed, args.layout):
+        print('Wrote', path)
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+import pyarrow as pa
+import streamlit as st
+
+# Times and measures peak memory of the data path (loading, dataset metadata, filtering, cube aggregation
+# and full page runs) against synthetic datasets from benchmarks.generate_data. With --destination duckdb the
+# datasets are loaded through the dashboard SQL, run by DuckDB over warehouse layout Parquet snapshots.
+#
+#   python -m benchmarks.run_benchmarks --rows 100000 1000000 --json bench.json
+#   python -m benchmarks.run_benchmarks --rows 1000000 --destination duckdb
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+# functions.query reads the connection variables from the session state on import.
+st.session_state.destination = 'Dunder Mifflin Sample Data'
+st.session_state.database = None
+st.session_state.schema = None
+
+from benchmarks.generate_data import generate
+from functions import query
+from functions.cache import dataset_cache
+from functions.cube import filter_cube, build_cube
+from functions.filters import filter_data
+from functions.leaderboard import assignee_stats
+from functions.workers import gather
+from functions.metadata import filter_columns, data_metadata, warehouse_metadata
+
+destination = 'Dunder Mifflin Sample Data'
+database = None
+pages = ['pages/1_ticket_metrics.py', 'pages/2_assignee_activity.py', 'pages/3_sla_policies.py']
+
+# Arrow pools of the measured runs. Buffers allocated in a run (like cached datasets) keep using its pool
+# after it ends, so the pools are kept alive.
+arrow_pools = []
+
+def measure(name, rows, fn, repeat):
+    # Best wall time over repeat runs, and peak memory of one extra run: traced Python allocations, and Arrow
+    # buffers (which tracemalloc does not see) from a pool counting the run's allocations only.
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    default_pool = pa.default_memory_pool()
+    arrow_pool = pa.proxy_memory_pool(default_pool)
+    arrow_pools.append(arrow_pool)
+    pa.set_memory_pool(arrow_pool)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+    record = {'benchmark': name, 'rows': rows, 'seconds': min(timings), 'peak_mb': peak / 1024 ** 2, 'arrow_peak_mb': arrow_pool.max_memory() / 1024 ** 2}
+    print(f"{name:<40} {rows:>10} {record['seconds']:>10.4f}s {record['peak_mb']:>10.1f} MB {record['arrow_peak_mb']:>10.1f} MB")
+    return record
+
+def cold_load(model):
+    dataset_cache().clear()
+    return query.query_results(destination, database, None, model)
+
+def cold_models():
+    dataset_cache().clear()
+    return gather(query.load_models(destination, database, None))
+
+def cold_pushdown_load(model, start, end, filters):
+    dataset_cache().clear()
+    return query.query_results(destination, database, None, model, start, end, filters)
+
+def top_filters(data, model):
+    # The most frequent value of every filter column, the typical "drill into one team" selection.
+    return {c: [data[c].value_counts().index[0]] for c in filter_columns[model][:3]}
+
+def run_page(page):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(repo_dir, page), default_timeout=600)
+    at.session_state['destination'] = destination
+    at.session_state['database'] = database
+    at.session_state['schema'] = None
+    at.run()
+    if len(at.exception) > 0:
+        raise RuntimeError(page + ': ' + at.exception[0].value)
+
+def prepare_files(size_dir, rows, file_format, layout):
+    ticket_path = os.path.join(size_dir, 'zendesk__ticket_metrics.' + file_format)
+    sla_path = os.path.join(size_dir, 'zendesk__sla_policies.' + file_format)
+    if not (os.path.exists(ticket_path) and os.path.exists(sla_path)):
+        print('Generating', rows, 'tickets in', size_dir)
+        generate(rows, size_dir, file_format, layout=layout)
+    return {'ticket': ticket_path, 'sla': sla_path}
+
+def benchmark_size(rows, data_dir, repeat, include_pages, file_format='csv'):
+    global database
+    size_dir = os.path.join(data_dir, str(rows))
+    if destination == 'DuckDB':
+        database = os.path.join(size_dir, 'warehouse')
+        prepare_files(database, rows, 'parquet', 'warehouse')
+    else:
+        query.sample_files = prepare_files(size_dir, rows, file_format, 'sample')
+
+    records = []
+    # Both models fetched at the same time, compare with the sum of the two cold loads.
+    records.append(measure('load_models cold (ticket + sla)', rows, cold_models, repeat))
+    for model in ('ticket', 'sla'):
+        records.append(measure('query_results cold (' + model + ')', rows, lambda: cold_load(model), repeat))
+        data = cold_load(model)
+        records.append(measure('query_results cached (' + model + ')', rows, lambda: query.query_results(destination, database, None, model), repeat))
+        records.append(measure('dataset metadata (' + model + ')', rows, lambda: data_metadata(data, model), repeat))
+        if destination == 'DuckDB':
+            records.append(measure('warehouse metadata (' + model + ')', rows, lambda: warehouse_metadata(destination, database, None, model), repeat))
+
+        end = data['created_at'].max().date()
+        start = end - timedelta(days=13)
+        filters = top_filters(data, model)
+        if destination == 'DuckDB':
+            records.append(measure('query_results pushdown two weeks + filters (' + model + ')', rows, lambda: cold_pushdown_load(model, start, end, filters), repeat))
+        records.append(measure('filter_data two weeks (' + model + ')', rows, lambda: filter_data(start, end, data, {}, model), repeat))
+        records.append(measure('filter_data two weeks + filters (' + model + ')', rows, lambda: filter_data(start, end, data, filters, model), repeat))
+        first = data['created_at'].min().date()
+        records.append(measure('filter_data full range (' + model + ')', rows, lambda: filter_data(first, end, data, {}, model), repeat))
+
+        records.append(measure('build cube (' + model + ')', rows, lambda: build_cube(data, model), repeat))
+        records.append(measure('filter_cube two weeks + filters (' + model + ')', rows, lambda: filter_cube(start, end, data, filters, model), repeat))
+        if model == 'ticket':
+            records.append(measure('assignee leaderboard two weeks', rows, lambda: assignee_stats(start, end, data, {}), repeat))
+            records.append(measure('assignee leaderboard two weeks approximate', rows, lambda: assignee_stats(start, end, data, {}, True), repeat))
+            records.append(measure('assignee leaderboard full range', rows, lambda: assignee_stats(first, end, data, {}), repeat))
+            records.append(measure('assignee leaderboard full range approximate', rows, lambda: assignee_stats(first, end, data, {}, True), repeat))
+
+    if include_pages:
+        # Warm the dataset cache first so the page timings cover the per rerun work.
+        cold_load('ticket')
+        query.query_results(destination, database, None, 'sla')
+        for page in pages:
+            records.append(measure('page ' + os.path.basename(page), rows, lambda: run_page(page), repeat))
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Zendesk dashboard data path on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000], help='Dataset sizes (tickets) to benchmark.')
+    parser.add_argument('--data-dir', default='bench_data', help='Directory holding (or receiving) the generated datasets.')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='File format the datasets are loaded from.')
+    parser.add_argument('--destination', choices=['sample', 'duckdb'], default='sample', help='Load the datasets as sample files, or through DuckDB.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-pages', action='store_true', help='Do not run the full page scripts.')
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+    data_dir = os.path.abspath(args.data_dir)
+    if args.destination == 'duckdb':
+        destination = 'DuckDB'
+
+    os.chdir(repo_dir)
+    print(f"{'benchmark':<40} {'rows':>10} {'time':>11} {'peak':>13} {'arrow peak':>13}")
+    results = []
+    for rows in args.rows:
+        results.extend(benchmark_size(rows, data_dir, args.repeat, not args.skip_pages, args.format))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
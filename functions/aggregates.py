@@ -0,0 +1,204 @@
+import pandas as pd
+import streamlit as st
+from functions.cache import dataset_cache
+from functions.profiling import stage
+from functions.query import model_columns, date_columns, from_clause, where_clause, fetch_results, result_frame, weekday_order
+
+# Aggregate mode: every chart is computed by one GROUP BY query in the warehouse, with the date range and
+# filters pushed down, so only chart sized results are transferred. Results are shared through the dataset
+# cache, keyed by the query and its parameters. The functions return the same shapes as the pandas versions
+# in the pages.
+
+def day_expression(expression):
+    return "cast(" + expression + " as date)"
+
+def bucket_expression(destination, expression, granularity):
+    # First day of the week (Monday) or month of a timestamp, like bucket_dates.
+    if granularity == 'day':
+        return day_expression(expression)
+    if destination == "BigQuery":
+        return "date_trunc(" + day_expression(expression) + ", " + ("week(monday)" if granularity == 'week' else "month") + ")"
+    return "cast(date_trunc('" + granularity + "', " + day_expression(expression) + ") as date)"
+
+def hour_expression(expression):
+    return "extract(hour from " + expression + ")"
+
+def weekday_expression(destination, expression):
+    # Numbered like pandas dayofweek, Monday = 0.
+    if destination == "BigQuery":
+        return "mod(extract(dayofweek from " + expression + ") + 5, 7)"
+    if destination == "Snowflake":
+        return "dayofweekiso(" + expression + ") - 1"
+    return "isodow(" + expression + ") - 1"
+
+def median_expression(destination, expression):
+    if destination == "BigQuery":
+        # BigQuery has no median aggregate, the middle of two approximate quantiles is the closest.
+        return "approx_quantiles(" + expression + ", 2)[offset(1)]"
+    return "median(" + expression + ")"
+
+def flag_expression(expression):
+    # Missing flags count as False, like normalize_dtypes.
+    return "coalesce(" + expression + ", false)"
+
+def count_if(condition):
+    # count() rather than sum() keeps the result a plain integer on every warehouse.
+    return "count(case when " + condition + " then 1 end)"
+
+def count_distinct_if(condition, expression):
+    return "count(distinct case when " + condition + " then " + expression + " end)"
+
+def aggregate_query(destination, database, schema, model, groups, measures, start_date=None, end_date=None, filter_dictionary=None, conditions=()):
+    # groups and measures map output column -> warehouse expression.
+    where, params = where_clause(destination, model, start_date, end_date, filter_dictionary)
+    if len(conditions) > 0:
+        where = (where + " and " if where else " where ") + " and ".join(conditions)
+    query = "select " + ", ".join(expression + " as " + column for column, expression in list(groups.items()) + list(measures.items())) + " "
+    query += from_clause(destination, database, schema, model) + where
+    if len(groups) > 0:
+        positions = ", ".join(str(i + 1) for i in range(len(groups)))
+        query += " group by " + positions + " order by " + positions
+    return query, params
+
+def warehouse_aggregate(model, groups, measures, start_date=None, end_date=None, filter_dictionary=None, conditions=(), dates=()):
+    destination, database, schema = st.session_state.destination, st.session_state.database, st.session_state.schema
+    query, params = aggregate_query(destination, database, schema, model, groups, measures, start_date, end_date, filter_dictionary, conditions)
+
+    def load():
+        data = result_frame(fetch_results(destination, query, params), list(groups) + list(measures))
+        for column in dates:
+            data[column] = pd.to_datetime(data[column])
+        return data
+
+    with stage('aggregate', 'warehouse ' + model + ' by ' + (', '.join(groups) or 'total')) as fields:
+        data = dataset_cache().get_or_load((destination, database, schema, model, 'aggregate', query, params), load)
+        fields['rows'] = len(data)
+    return data
+
+def cube_measures(model):
+    columns = model_columns[model]
+    if model == 'ticket':
+        return {
+            'created_tickets': "count(*)",
+            'solved_tickets': count_if(columns['status'] + " = 'solved'"),
+            'first_solved_tickets': "count(" + columns['first_solved_at'] + ")",
+            'one_touch_tickets': count_if(flag_expression(columns['is_one_touch_resolution'])),
+            'two_touch_tickets': count_if(flag_expression(columns['is_two_touch_resolution']))
+        }
+    completed = "not " + flag_expression(columns['is_active_sla'])
+    breached = flag_expression(columns['is_sla_breach'])
+    return {
+        'sla_events': "count(*)",
+        'achieved_slas': count_if("not " + breached),
+        'completed_achieved_slas': count_if(completed + " and not " + breached),
+        'completed_breached_slas': count_if(completed + " and " + breached)
+    }
+
+def warehouse_cube(start, end, filter_dictionary, model='ticket', dimensions=()):
+    # The daily cube measures of filter_cube, summed in the warehouse by day and only the given dimensions.
+    day_column = 'created_at' if model == 'ticket' else 'sla_applied_at'
+    groups = {day_column: day_expression(date_columns[model])}
+    groups.update({column: model_columns[model][column] for column in dimensions})
+    return warehouse_aggregate(model, groups, cube_measures(model), start, end, filter_dictionary, dates=[day_column])
+
+def hourly_counts(start, end, filter_dictionary, model='ticket'):
+    # Rows by hour of creation (tickets) or of SLA breach, named like the pandas count.
+    if model == 'ticket':
+        timestamp, counted = model_columns[model]['created_timestamp'], 'ticket_id'
+    else:
+        timestamp, counted = model_columns[model]['sla_breach_at'], 'sla_event_id'
+    data = warehouse_aggregate(model, {'hour': hour_expression(timestamp)}, {counted: "count(" + model_columns[model][counted] + ")"}, start, end, filter_dictionary)
+    return data.set_index('hour')[counted]
+
+def weekday_counts(start, end, filter_dictionary, model='ticket'):
+    # Tickets by created weekday name (Sunday first, every day present), or SLAs by breach dayofweek number.
+    destination = st.session_state.destination
+    if model == 'ticket':
+        timestamp = model_columns[model]['created_at']
+    else:
+        timestamp = model_columns[model]['sla_breach_at']
+    counts = {'ticket_id': "count(" + model_columns[model]['ticket_id'] + ")"}
+    data = warehouse_aggregate(model, {'weekday': weekday_expression(destination, timestamp)}, counts, start, end, filter_dictionary)
+    counts = data.set_index('weekday')['ticket_id']
+    if model == 'ticket':
+        names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        counts = counts.rename(index=dict(enumerate(names))).reindex(weekday_order, fill_value=0).rename_axis('day_of_week')
+    else:
+        counts = counts.rename_axis('breach_weekday')
+    return counts
+
+def attribute_counts(start, end, filter_dictionary, column, model='ticket'):
+    # Like value_counts of the column: non missing values, most frequent first.
+    expression = model_columns[model][column]
+    data = warehouse_aggregate(model, {column: expression}, {'row_count': "count(*)"}, start, end, filter_dictionary, conditions=[expression + " is not null"])
+    return data.set_index(column)['row_count'].rename('count').sort_values(ascending=False, kind='stable')
+
+def date_attribute_counts(start, end, filter_dictionary, column, model='ticket', granularity='day'):
+    destination = st.session_state.destination
+    expression = model_columns[model][column]
+    groups = {'created_at': bucket_expression(destination, date_columns[model], granularity), column: expression}
+    data = warehouse_aggregate(model, groups, {'row_count': "count(*)"}, start, end, filter_dictionary, conditions=[expression + " is not null"], dates=['created_at'])
+    return data.rename(columns={'row_count': 'Number of Tickets'})
+
+def month_counts():
+    # Tickets by year and month of creation over the whole model, without the date range or filters.
+    created_at = model_columns['ticket']['created_at']
+    groups = {'year': "extract(year from " + created_at + ")", 'month': "extract(month from " + created_at + ")"}
+    return warehouse_aggregate('ticket', groups, {'row_count': "count(*)"}).rename(columns={'row_count': 'Number of Tickets'})
+
+def wait_time_bracket_counts(start, end, filter_dictionary, bins, labels):
+    # Tickets per requester wait time bracket (right closed like pd.cut), and the total number of tickets.
+    wait_time = model_columns['ticket']['requester_wait_time_in_calendar_minutes']
+    cases = " ".join("when " + wait_time + " > " + str(low) + (" and " + wait_time + " <= " + str(high) if high != float('inf') else "") + " then '" + label + "'"
+                     for low, high, label in zip(bins[:-1], bins[1:], labels))
+    data = warehouse_aggregate('ticket', {'bracket': "case " + cases + " end"}, {'row_count': "count(*)"}, start, end, filter_dictionary)
+    counts = data.dropna(subset=['bracket']).set_index('bracket')['row_count'].rename('count').reindex(labels, fill_value=0)
+    return counts.sort_values(ascending=False, kind='stable'), int(data['row_count'].sum())
+
+def ticket_medians(start, end, filter_dictionary):
+    destination = st.session_state.destination
+    columns = ['requester_wait_time_in_calendar_minutes', 'first_assignment_to_resolution_calendar_minutes']
+    measures = {column: median_expression(destination, model_columns['ticket'][column]) for column in columns}
+    return warehouse_aggregate('ticket', {}, measures, start, end, filter_dictionary).iloc[0]
+
+def daily_median_wait_time(start, end, filter_dictionary, granularity='day'):
+    # Median wait time and tickets by day, or by week or month bucket.
+    destination = st.session_state.destination
+    measures = {
+        'requester_wait_time_in_calendar_minutes': median_expression(destination, model_columns['ticket']['requester_wait_time_in_calendar_minutes']),
+        'ticket_id': "count(" + model_columns['ticket']['ticket_id'] + ")"
+    }
+    return warehouse_aggregate('ticket', {'created_at': bucket_expression(destination, date_columns['ticket'], granularity)}, measures, start, end, filter_dictionary, dates=['created_at'])
+
+def assignee_activity(start, end, filter_dictionary):
+    # Solved tickets and median metrics in hours per assignee, like the assignee table groupby.
+    destination = st.session_state.destination
+    columns = model_columns['ticket']
+    medians = {
+        'first_reply_time_median': 'first_reply_time_calendar_minutes',
+        'requester_wait_time_median': 'requester_wait_time_in_calendar_minutes',
+        'last_assignment_resolution_time_median': 'last_assignment_to_resolution_calendar_minutes',
+        'final_resolution_time_median': 'final_resolution_calendar_minutes'
+    }
+    measures = {'solved_tickets_count': count_if(columns['status'] + " = 'solved'")}
+    measures.update({name: median_expression(destination, columns[column]) for name, column in medians.items()})
+    data = warehouse_aggregate('ticket', {'assignee_name': columns['assignee_name']}, measures, start, end, filter_dictionary, conditions=[columns['assignee_name'] + " is not null"])
+    data = data.copy()
+    for name in medians:
+        data[name] = (data[name].astype('float64') / 60).round(2)
+    return data
+
+def sla_ticket_counts(start, end, filter_dictionary):
+    # Distinct tickets behind the SLA KPI tiles, and the number of distinct breach dates.
+    columns = model_columns['sla']
+    ticket_id = columns['ticket_id']
+    breached = flag_expression(columns['is_sla_breach'])
+    inactive = "not " + flag_expression(columns['is_active_sla'])
+    measures = {
+        'breached_tickets': count_distinct_if(breached, ticket_id),
+        'achieved_tickets': count_distinct_if("not " + breached, ticket_id),
+        'active_tickets': count_distinct_if(inactive, ticket_id),
+        'active_breached_tickets': count_distinct_if(breached + " and " + inactive, ticket_id),
+        'breach_days': "count(distinct " + day_expression(columns['sla_breach_at']) + ")"
+    }
+    return warehouse_aggregate('sla', {}, measures, start, end, filter_dictionary).iloc[0]
@@ -0,0 +1,44 @@
+import os
+import pandas as pd
+import streamlit as st
+
+# Date charts draw one bar or point per date bucket. Long date ranges are bucketed by week (starting on Monday)
+# or by month, so a chart has at most chart_max_points buckets, and its counts are summed and its medians
+# computed per bucket before the chart data is built.
+chart_max_points = int(os.environ.get('ZENDESK_CHART_MAX_POINTS', 60))
+granularities = ['day', 'week', 'month']
+# Labels of week and month buckets, day labels keep the format of each chart.
+label_formats = {'week': '%Y-%m-%d', 'month': '%Y-%m'}
+captions = {'week': 'Grouped by week, each week is labelled with its Monday.', 'month': 'Grouped by month.'}
+
+def bucket_count(start, end, granularity):
+    # Number of buckets touched by the date range.
+    if granularity == 'week':
+        return ((end - pd.Timedelta(days=end.weekday())) - (start - pd.Timedelta(days=start.weekday()))).days // 7 + 1
+    if granularity == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return (end - start).days + 1
+
+def chart_granularity(start, end, selected='auto'):
+    # The finest granularity keeping the date range within chart_max_points buckets. A selected granularity
+    # is used as is unless it goes over the limit, then it is coarsened. Month is the coarsest.
+    candidates = granularities if selected == 'auto' else granularities[granularities.index(selected):]
+    for granularity in candidates:
+        if bucket_count(start, end, granularity) <= chart_max_points:
+            return granularity
+    return 'month'
+
+def bucket_dates(dates, granularity):
+    # The first day of the bucket of each date. Dates are day timestamps, missing dates stay missing.
+    if granularity == 'week':
+        return dates - pd.to_timedelta(dates.dt.dayofweek, unit='D')
+    if granularity == 'month':
+        return dates - pd.to_timedelta(dates.dt.day - 1, unit='D')
+    return dates
+
+def bucket_labels(dates, granularity, day_format):
+    return dates.dt.strftime(label_formats.get(granularity, day_format))
+
+def bucket_caption(granularity):
+    if granularity in captions:
+        st.caption(captions[granularity])
@@ -0,0 +1,359 @@
+import os
+import logging
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+from functions.profiling import stage, record, cache_detail, result_rows
+
+# Limits for the shared dataset cache, configurable through environment variables.
+cache_ttl = int(os.environ.get('ZENDESK_CACHE_TTL', 600))
+cache_max_entries = int(os.environ.get('ZENDESK_CACHE_MAX_ENTRIES', 32))
+cache_max_bytes = int(os.environ.get('ZENDESK_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Entries in use are reloaded in the background this many seconds before their TTL runs out, and expired
+# entries are served stale while they are reloaded. 0 workers turns background refreshes off.
+cache_refresh_ahead = int(os.environ.get('ZENDESK_CACHE_REFRESH_AHEAD', 60))
+cache_refresh_workers = int(os.environ.get('ZENDESK_CACHE_REFRESH_WORKERS', 2))
+# Expired entries are not served stale for longer than this many seconds past their load (default twice the
+# TTL), so a refresh that keeps failing does not serve old data forever: the next read waits for a load.
+cache_max_stale = int(os.environ.get('ZENDESK_CACHE_MAX_STALE', 2 * cache_ttl))
+# Datasets of every tenant (destination, database and schema) share the byte limit. Over it, the least recently
+# used tenant's datasets are evicted together, and written to this directory when it is set, so the tenant's
+# next visit reads them back from disk instead of querying the warehouse again.
+cache_spill_dir = os.environ.get('ZENDESK_SPILL_DIR', '')
+
+logger = logging.getLogger(__name__)
+
+# Functions giving the memory derived from a cached value, like the filter indexes built for a DataFrame,
+# registered by the modules building it. Entries are accounted with it.
+size_hooks = []
+
+def value_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(value_size(item) for item in list(value.values()))
+    return 0
+
+def entry_size(value):
+    return sum(hook(value) for hook in size_hooks)
+
+class DatasetCache:
+    # Process wide LRU cache with a TTL and entry/byte limits, shared by every session.
+    # Loads are serialized per key so concurrent sessions asking for the same dataset only query it once.
+    # With refresh workers, only the first load of a key blocks: entries are reloaded by the workers while the
+    # previous value keeps being served, up to max_stale seconds after it was loaded.
+    # With tenant (a function of the key), the byte limit evicts the least recently used other tenant's entries
+    # first, spilling their DataFrames to spill_dir when it is set.
+    # Caches added to shared count against the byte limit, but are not evicted by this cache.
+    def __init__(self, ttl, max_entries, max_bytes, refresh_ahead=0, refresh_workers=0, tenant=None, spill_dir='', max_stale=None):
+        self.ttl = ttl
+        self.max_stale = max(ttl, 2 * ttl if max_stale is None else max_stale)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # Size of every value alone, entries are accounted with what was built from them since.
+        self.value_sizes = {}
+        # Key of every cached value by identity, to account what is built from it.
+        self.owners = {}
+        self.shared = []
+        self.lock = threading.Lock()
+        # Lock of every key being loaded and the number of loads holding or waiting for it.
+        self.key_locks = {}
+        # Loader of every entry, the keys read since they were (re)loaded and the keys being reloaded.
+        self.loaders = {}
+        self.used = set()
+        self.refreshing = set()
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        # Last use of every tenant with entries, least recently used first, and the spilled entries:
+        # key -> (path, loaded_at, size, loader).
+        self.tenant = tenant
+        self.tenants = OrderedDict()
+        self.spill_dir = spill_dir
+        self.spilled = {}
+        self.spill_ids = itertools.count()
+        self.refresh_pool = None
+        if refresh_workers > 0:
+            self.refresh_pool = ThreadPoolExecutor(refresh_workers, thread_name_prefix='dataset-refresh')
+            threading.Thread(target=self.refresh_loop, name='dataset-refresh-scheduler', daemon=True).start()
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            loaded_at, size, value = entry
+            age = time.time() - loaded_at
+            if age > self.ttl and (self.refresh_pool is None or key not in self.loaders or age > self.max_stale):
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            self.used.add(key)
+            self.touch(key)
+        if age > self.ttl - self.refresh_ahead:
+            # Due or past due: serve this value and reload it in the background.
+            self.schedule_refresh(key)
+        return entry
+
+    def get_or_load(self, key, loader):
+        entry = self.lookup(key)
+        if entry is not None:
+            record('cache', cache_detail(key), cache='hit', rows=result_rows(entry[2]))
+            return entry[2]
+
+        with self.key_lock(key):
+            # Another session may have loaded the key while we were waiting.
+            entry = self.lookup(key)
+            if entry is not None:
+                record('cache', cache_detail(key), cache='hit', rows=result_rows(entry[2]))
+                return entry[2]
+            with stage('cache', cache_detail(key)) as fields:
+                value = self.restore(key)
+                if value is not None:
+                    fields.update(cache='spill', rows=result_rows(value))
+                    return value
+                value = loader()
+                fields.update(cache='miss', rows=result_rows(value))
+            self.put(key, value, loader)
+            return value
+
+    @contextmanager
+    def key_lock(self, key):
+        # Serializes the loads of a key. The lock is dropped once no load holds or waits for it.
+        with self.lock:
+            entry = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.key_locks[key]
+
+    def put(self, key, value, loader=None, loaded_at=None):
+        size = value_size(value)
+        extra = entry_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (loaded_at or time.time(), size + extra, value)
+            self.value_sizes[key] = size
+            self.owners[id(value)] = key
+            self.total_bytes += size + extra
+            if loader is not None:
+                self.loaders[key] = loader
+            self.touch(key)
+            evicted = self.enforce_limits(key)
+        for entry in evicted:
+            self.spill(*entry)
+
+    def grow(self, value, size):
+        # Accounts size more bytes built from a cached value, like its indexes, and enforces the limits again,
+        # keeping its entry. Values that are not cached are left out.
+        with self.lock:
+            key = self.owners.get(id(value))
+            entry = self.entries.get(key)
+            if entry is None or entry[2] is not value:
+                return
+            self.entries[key] = (entry[0], entry[1] + size, value)
+            self.total_bytes += size
+            evicted = self.enforce_limits(key)
+        for entry in evicted:
+            self.spill(*entry)
+
+    def trim(self):
+        # Enforces the limits again once the shared caches grew, keeping the most recently used entry.
+        with self.lock:
+            evicted = self.enforce_limits(next(reversed(self.entries))) if len(self.entries) > 0 else []
+        for entry in evicted:
+            self.spill(*entry)
+
+    def over_budget(self):
+        return self.total_bytes + sum(cache.total_bytes for cache in self.shared) > self.max_bytes
+
+    def enforce_limits(self, keep):
+        # Callers hold self.lock. Over the byte limit, evicts the least recently used other tenants whole, then
+        # the least recently used entries, but always keeps the entry keep. Returns the removed entries to spill.
+        evicted = []
+        while self.tenant is not None and self.over_budget():
+            others = [tenant for tenant in self.tenants if tenant != self.tenant(keep)]
+            if len(others) == 0:
+                break
+            evicted += self.remove_tenant(others[0])
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.over_budget()):
+            self.remove(next(key for key in self.entries if key != keep))
+        return evicted
+
+    def touch(self, key):
+        # Callers hold self.lock.
+        if self.tenant is not None:
+            tenant = self.tenant(key)
+            self.tenants[tenant] = time.time()
+            self.tenants.move_to_end(tenant)
+
+    def remove_tenant(self, tenant):
+        # Callers hold self.lock. Returns the removed entries to spill.
+        evicted = []
+        for key in [key for key in self.entries if self.tenant(key) == tenant]:
+            loaded_at, size, value = self.entries[key]
+            loader = self.loaders.get(key)
+            self.remove(key)
+            if self.spill_dir and isinstance(value, pd.DataFrame):
+                evicted.append((key, loaded_at, value, loader))
+        self.tenants.pop(tenant, None)
+        logger.info('Evicted the datasets of %s, %d bytes cached', tenant, self.total_bytes)
+        return evicted
+
+    def evict_tenant(self, tenant):
+        with self.lock:
+            evicted = self.remove_tenant(tenant)
+        for entry in evicted:
+            self.spill(*entry)
+
+    def spill(self, key, loaded_at, value, loader):
+        path = os.path.join(self.spill_dir, str(os.getpid()) + '-' + str(next(self.spill_ids)) + '.parquet')
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            value.to_parquet(path, index=False)
+        except Exception:
+            logger.exception('Spilling %s to disk failed', cache_detail(key))
+            return
+        with self.lock:
+            # Keys loaded again while they were written are not spilled, and expired spills are dropped.
+            now = time.time()
+            dropped = [spilled_key for spilled_key, spilled in self.spilled.items() if now - spilled[1] > self.ttl or spilled_key == key]
+            dropped_paths = [self.spilled.pop(spilled_key)[0] for spilled_key in dropped]
+            if key in self.entries:
+                dropped_paths.append(path)
+            else:
+                self.spilled[key] = (path, loaded_at, os.path.getsize(path), loader)
+        for dropped_path in dropped_paths:
+            remove_file(dropped_path)
+
+    def restore(self, key):
+        # The spilled value of the key, put back in the cache, or None. Expired spills are reloaded instead.
+        with self.lock:
+            spilled = self.spilled.pop(key, None)
+        if spilled is None:
+            return None
+        path, loaded_at, size, loader = spilled
+        try:
+            if time.time() - loaded_at > self.ttl:
+                return None
+            value = pd.read_parquet(path)
+        except Exception:
+            logger.exception('Reading the spilled %s failed', cache_detail(key))
+            return None
+        finally:
+            remove_file(path)
+        self.put(key, value, loader, loaded_at)
+        if time.time() - loaded_at > self.ttl - self.refresh_ahead:
+            self.schedule_refresh(key)
+        return value
+
+    def tenant_usage(self):
+        # One row per tenant with entries in memory or spilled: entries and bytes in memory (and how many of them
+        # were built from the values, like indexes), spilled entries and their size on disk, and when the tenant
+        # was last used.
+        usage = {}
+        with self.lock:
+            entries = [(key, size, size - self.value_sizes[key]) for key, (loaded_at, size, value) in self.entries.items()]
+            spilled = [(key, size) for key, (path, loaded_at, size, loader) in self.spilled.items()]
+            last_used = dict(self.tenants)
+        for key, size, index_size in entries:
+            row = usage.setdefault(self.tenant(key), dict.fromkeys(['entries', 'bytes', 'index_bytes', 'spilled_entries', 'spilled_bytes'], 0))
+            row['entries'] += 1
+            row['bytes'] += size
+            row['index_bytes'] += index_size
+        for key, size in spilled:
+            row = usage.setdefault(self.tenant(key), dict.fromkeys(['entries', 'bytes', 'index_bytes', 'spilled_entries', 'spilled_bytes'], 0))
+            row['spilled_entries'] += 1
+            row['spilled_bytes'] += size
+        return [dict(tenant=tenant, last_used=last_used.get(tenant), **row) for tenant, row in usage.items()]
+
+    def remove(self, key):
+        # Callers hold self.lock.
+        loaded_at, size, value = self.entries.pop(key)
+        self.total_bytes -= size
+        self.value_sizes.pop(key, None)
+        if self.owners.get(id(value)) == key:
+            del self.owners[id(value)]
+        self.loaders.pop(key, None)
+        self.used.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.value_sizes.clear()
+            self.owners.clear()
+            self.loaders.clear()
+            self.used.clear()
+            self.tenants.clear()
+            paths = [path for path, loaded_at, size, loader in self.spilled.values()]
+            self.spilled.clear()
+        for path in paths:
+            remove_file(path)
+
+    def schedule_refresh(self, key):
+        with self.lock:
+            if self.refresh_pool is None or key in self.refreshing or key not in self.loaders:
+                return
+            self.refreshing.add(key)
+            loader = self.loaders[key]
+        self.refresh_pool.submit(self.refresh, key, loader)
+
+    def refresh(self, key, loader):
+        try:
+            with self.key_lock(key):
+                value = loader()
+            with self.lock:
+                # Entries evicted while they were reloading stay evicted.
+                evicted = key not in self.entries
+            if not evicted:
+                self.put(key, value, loader)
+        except Exception:
+            # The previous value keeps being served, the next scan or read retries.
+            logger.exception('Background refresh of %s failed', cache_detail(key))
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def refresh_loop(self):
+        # Reloads the entries read since their last load shortly before they expire. Unused entries are left
+        # to expire, so datasets nobody looks at are not queried again.
+        while True:
+            time.sleep(max(1, self.refresh_ahead / 2))
+            now = time.time()
+            with self.lock:
+                due = [key for key, (loaded_at, size, value) in self.entries.items() if key in self.used and now - loaded_at > self.ttl - self.refresh_ahead]
+            for key in due:
+                self.schedule_refresh(key)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def key_tenant(key):
+    # Dataset cache keys start with the destination, database and schema.
+    return key[:3]
+
+@st.cache_resource(show_spinner=False)
+def dataset_cache():
+    return DatasetCache(cache_ttl, cache_max_entries, cache_max_bytes, cache_refresh_ahead, cache_refresh_workers, key_tenant, cache_spill_dir, cache_max_stale)
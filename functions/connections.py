@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import threading
+import duckdb
+import requests
+import streamlit as st
+from google.api_core import exceptions as google_exceptions
+from google.auth import exceptions as auth_exceptions
+from google.oauth2 import service_account
+from google.cloud import bigquery
+
+# Warehouse clients shared by every session and rerun, instead of authenticating for every query.
+# Each destination has a bounded pool: at most pool_size queries run at once per destination, and
+# clients idle for longer than pool_check_after seconds are health checked before they are reused.
+# A query failing on a reused client is retried once on a new client, when the error is a connection error
+# or the client fails its health check. Other errors, like SQL errors, are raised without running it again.
+pool_size = int(os.environ.get('ZENDESK_POOL_SIZE', 4))
+pool_check_after = 60
+
+logger = logging.getLogger(__name__)
+
+# Connection and transport errors of every destination.
+connection_errors = (ConnectionError, TimeoutError)
+
+class ClientPool:
+    def __init__(self, create, check=None, close=None, size=pool_size, lost_errors=connection_errors):
+        self.create = create
+        self.check = check
+        self.close = close
+        self.lost_errors = lost_errors
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def healthy(self, client):
+        try:
+            self.check(client)
+            return True
+        except Exception:
+            return False
+
+    def discard(self, client):
+        if self.close is not None:
+            try:
+                self.close(client)
+            except Exception:
+                pass
+
+    def checkout(self):
+        # The most recently returned idle client, or a new one. Returns whether the client was reused.
+        while True:
+            with self.lock:
+                if len(self.idle) == 0:
+                    return self.create(), False
+                client, returned_at = self.idle.pop()
+            if self.check is None or time.time() - returned_at < pool_check_after or self.healthy(client):
+                return client, True
+            self.discard(client)
+
+    def run(self, fn):
+        # Runs fn(client) on a pooled client and returns its result.
+        with self.slots:
+            client, reused = self.checkout()
+            while True:
+                try:
+                    result = fn(client)
+                    break
+                except Exception as error:
+                    if not self.lost(client, error):
+                        self.release(client)
+                        raise
+                    self.discard(client)
+                    if not reused:
+                        raise
+                    # The connection may have gone stale while it was idle: reconnect and retry once.
+                    logger.warning('Query failed on a pooled connection, retrying on a new one', exc_info=True)
+                    client, reused = self.create(), False
+            self.release(client)
+            return result
+
+    def lost(self, client, error):
+        # Whether the query failed because of the connection rather than the query itself.
+        return isinstance(error, self.lost_errors) or (self.check is not None and not self.healthy(client))
+
+    def release(self, client):
+        with self.lock:
+            self.idle.append((client, time.time()))
+
+def bigquery_client():
+    credentials = service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"]
+    )
+    return bigquery.Client(credentials=credentials)
+
+def snowflake_session():
+    # Snowpark is only needed for the Snowflake destination.
+    from snowflake.snowpark import Session
+    return Session.builder.configs(dict(st.secrets["connections"]["snowpark"])).create()
+
+@st.cache_resource(show_spinner=False)
+def duckdb_connection():
+    # One in-process DuckDB database per server, queried through a cursor per pooled client so sessions can run concurrently.
+    return duckdb.connect()
+
+@st.cache_resource(show_spinner=False)
+def warehouse_pool(destination):
+    if destination == "BigQuery":
+        # The BigQuery client is stateless HTTP, queries failing on transport errors are retried on a new client.
+        lost_errors = connection_errors + (requests.exceptions.ConnectionError, auth_exceptions.TransportError, google_exceptions.ServiceUnavailable)
+        return ClientPool(bigquery_client, close=lambda client: client.close(), lost_errors=lost_errors)
+    if destination == "Snowflake":
+        return ClientPool(snowflake_session, check=lambda session: session.sql("select 1").collect(), close=lambda session: session.close())
+    return ClientPool(lambda: duckdb_connection().cursor(), check=lambda cursor: cursor.execute("select 1"), close=lambda cursor: cursor.close(), lost_errors=connection_errors + (duckdb.ConnectionException,))
@@ -0,0 +1,73 @@
+import pandas as pd
+from datetime import timedelta
+from functions.filters import filter_index, filter_positions, store_index
+from functions.profiling import stage
+
+# Dimensions with a daily cube of their own. Measures are additive so any date range, or selection on one of
+# these dimensions, is answered by summing cube cells. The cubes are keyed by day and at most one dimension:
+# the combinations of all dimensions of a day rarely repeat, so a cube of them all is about as large as the
+# rows. Selections on two or more dimensions, or on requester organizations or assignees, are summed from
+# the filtered rows instead.
+cube_dimensions = {
+    'ticket': ['ticket_group', 'ticket_brand', 'ticket_channel', 'ticket_form', 'submitter_role'],
+    'sla': ['sla_policy_name', 'metric', 'ticket_group', 'ticket_brand', 'ticket_form', 'ticket_channel']
+}
+
+def build_ticket_cube(data, dimensions=()):
+    measures = pd.DataFrame({
+        'created_at': data['created_at'].dt.normalize(),
+        'created_tickets': 1,
+        'solved_tickets': data['status'] == 'solved',
+        'first_solved_tickets': data['first_solved_at'].notna(),
+        'one_touch_tickets': data['is_one_touch_resolution'],
+        'two_touch_tickets': data['is_two_touch_resolution']
+    })
+    measures[list(dimensions)] = data[list(dimensions)]
+    return measures.groupby(['created_at'] + list(dimensions), observed=True, dropna=False).sum().reset_index()
+
+def build_sla_cube(data, dimensions=()):
+    completed = ~data['is_active_sla']
+    measures = pd.DataFrame({
+        'sla_applied_at': data['sla_applied_at'].dt.normalize(),
+        'sla_events': 1,
+        'achieved_slas': ~data['is_sla_breach'],
+        'completed_achieved_slas': completed & ~data['is_sla_breach'],
+        'completed_breached_slas': completed & data['is_sla_breach']
+    })
+    measures[list(dimensions)] = data[list(dimensions)]
+    return measures.groupby(['sla_applied_at'] + list(dimensions), observed=True, dropna=False).sum().reset_index()
+
+def build_cube(data, model='ticket', dimensions=()):
+    if model == 'ticket':
+        return build_ticket_cube(data, dimensions)
+    return build_sla_cube(data, dimensions)
+
+def dataset_cube(data_ref, model='ticket', dimensions=()):
+    # Built once per loaded dataset and dimension, alongside its filter indexes.
+    index = filter_index(data_ref)
+    if ('cube', model, tuple(dimensions)) not in index:
+        store_index(data_ref, ('cube', model, tuple(dimensions)), build_cube(data_ref, model, dimensions))
+    return index[('cube', model, tuple(dimensions))]
+
+def filter_cube(start, end, data_ref, filter_dictionary, model='ticket', dimensions=()):
+    # Same date range and filter semantics as filter_data, applied to the cells of the cube by day and the
+    # given dimensions (like warehouse_cube) instead of the rows.
+    active = [k for k, v in filter_dictionary.items() if len(v) > 0 and None not in v]
+    keys = list(dict.fromkeys(list(dimensions) + active))
+    cubed = len(keys) <= 1 and all(key in cube_dimensions[model] for key in keys)
+    with stage('aggregate', ('daily cube ' if cubed else 'rows cube ') + model) as fields:
+        if cubed:
+            cube = dataset_cube(data_ref, model, keys)
+            if model == 'ticket':
+                cells = cube.iloc[filter_positions(start, end, cube, filter_dictionary, model)]
+            else:
+                # The cells of a day are all dated at its midnight, so the cube gives the days before the end
+                # date and the SLAs applied exactly at the end date's midnight are added from the rows.
+                cells = cube.iloc[filter_positions(start, end - timedelta(days=1), cube, filter_dictionary, model)]
+                midnight = data_ref.iloc[filter_positions(end, end, data_ref, filter_dictionary, model)]
+                if len(midnight) > 0:
+                    cells = pd.concat([cells, build_cube(midnight, model, keys)], ignore_index=True)
+        else:
+            cells = build_cube(data_ref.iloc[filter_positions(start, end, data_ref, filter_dictionary, model)], model, keys)
+        fields['rows'] = len(cells)
+    return cells
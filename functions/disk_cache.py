@@ -0,0 +1,34 @@
+import os
+import re
+import threading
+import pandas as pd
+
+# Directory for the persistent parquet cache of the warehouse models. The cache is disabled unless this is set.
+cache_dir = os.environ.get('ZENDESK_CACHE_DIR', '')
+
+def disk_cache_enabled():
+    return cache_dir != ''
+
+def cache_path(destination, database, schema, model):
+    name = "_".join(re.sub(r'[^A-Za-z0-9]+', '-', str(part)) for part in (destination, database, schema, model))
+    return os.path.join(cache_dir, name + ".parquet")
+
+def read_cache(path):
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+def write_cache(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so readers never see a half written cache.
+    tmp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    data.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def merge_rows(cached, new, key):
+    # Rows in new replace cached rows with the same key.
+    if cached is None or len(cached) == 0:
+        return new
+    if len(new) == 0:
+        return cached
+    return pd.concat([cached[~cached[key].isin(new[key])], new], ignore_index=True)
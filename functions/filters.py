@@ -1,16 +1,20 @@
 import streamlit as st
+import pandas as pd
+import numpy as np
+import weakref
 from datetime import datetime, timedelta
 from functions.query import query_results
+from functions.cache import dataset_cache, value_size, size_hooks
+from functions.metadata import dataset_metadata
+from functions.profiling import stage
 
 def date_filter(dest, db, sc, md='ticket'):
     current_date = datetime.today().date()
     start_of_week = current_date - timedelta(days=(current_date.weekday() + 1) % 7)
     end_of_week = start_of_week + timedelta(days=6)
 
-    data = query_results(destination=dest, database=db, schema=sc, model=md)
-
-    # Extract the maximum date from your data
-    latest_date_in_data = max(data['created_at'])
+    # The latest date comes from the cached dataset metadata, the rows are loaded once the range is known.
+    latest_date_in_data = dataset_metadata(destination=dest, database=db, schema=sc, model=md)['max_date']
 
     # Compute the end of the week for the latest date
     end_of_week = latest_date_in_data - timedelta(days=(latest_date_in_data.weekday() - 6))
@@ -33,27 +37,41 @@ def date_filter(dest, db, sc, md='ticket'):
     # Update the session state with the selected dates
     st.session_state.start_date, st.session_state.end_date = date_range
 
-    return data, date_range
+    return date_range
+
+def dataset_rows(dest, db, sc, md='ticket', filter_dictionary=None):
+    # Rows for the selected date range, loaded after the filter bar has rendered.
+    if st.session_state.get('aggregate', False):
+        # The charts are aggregated in the warehouse, no rows are loaded.
+        return None
+    if st.session_state.get('pushdown', False):
+        # Push the date range and the optional filters down so only the matching rows are transferred.
+        return query_results(destination=dest, database=db, schema=sc, model=md, start_date=st.session_state.start_date, end_date=st.session_state.end_date, filter_dictionary=filter_dictionary)
+    return query_results(destination=dest, database=db, schema=sc, model=md)
 
-def optional_filters(data_ref, include_assignee):
+def filter_options(column, model='ticket'):
+    # Every value of the column in the model, from the cached dataset metadata.
+    return dataset_metadata(st.session_state.destination, st.session_state.database, st.session_state.schema, model)['values'][column].index
+
+def optional_filters(include_assignee):
     opt1, opt2, opt3 = st.columns(3)
     with opt1:
-        selected_groups = st.multiselect('(Optional) Groups to filter', data_ref['ticket_group'].unique(), default=None)
+        selected_groups = st.multiselect('(Optional) Groups to filter', filter_options('ticket_group'), default=None)
     with opt2:
-        selected_brands = st.multiselect('(Optional) Brands to filter', data_ref['ticket_brand'].unique(), default=None)
+        selected_brands = st.multiselect('(Optional) Brands to filter', filter_options('ticket_brand'), default=None)
     with opt3:
-        selected_channels = st.multiselect('(Optional) Channels to filter', data_ref['ticket_channel'].unique(), default=None)
+        selected_channels = st.multiselect('(Optional) Channels to filter', filter_options('ticket_channel'), default=None)
 
     opt3, opt4, opt5 = st.columns(3)
     with opt3:
-        selected_forms = st.multiselect('(Optional) Forms to filter', data_ref['ticket_form'].unique(), default=None)
+        selected_forms = st.multiselect('(Optional) Forms to filter', filter_options('ticket_form'), default=None)
     with opt4:
-        selected_submitter_roles = st.multiselect('(Optional) Submitter roles to filter', data_ref['submitter_role'].unique(), default=None)
+        selected_submitter_roles = st.multiselect('(Optional) Submitter roles to filter', filter_options('submitter_role'), default=None)
     with opt5:
-        selected_req_organizations = st.multiselect('(Optional) Requester orgs to filter', data_ref['requester_organization'].unique(), default=None)
+        selected_req_organizations = st.multiselect('(Optional) Requester orgs to filter', filter_options('requester_organization'), default=None)
 
     if include_assignee:
-        selected_assignee = st.multiselect('(Optional) Assignee(s) to filter', data_ref['assignee_name'].unique(), default=None)
+        selected_assignee = st.multiselect('(Optional) Assignee(s) to filter', filter_options('assignee_name'), default=None)
         filter_dict = {'ticket_group': selected_groups, 'ticket_brand': selected_brands, 'ticket_channel': selected_channels, 'ticket_form': selected_forms,'submitter_role': selected_submitter_roles, 'requester_organization': selected_req_organizations, 'assignee_name': selected_assignee}
         
         return filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations, selected_assignee
@@ -63,41 +81,166 @@ def optional_filters(data_ref, include_assignee):
         
         return filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations
 
-def sla_optional_filters(data_ref):
+def sla_optional_filters():
     opt1, opt2, opt3 = st.columns(3)
     with opt1:
-        selected_sla_name = st.multiselect('(Optional) SLA policy name to filter', data_ref['sla_policy_name'].unique(), default=None)
+        selected_sla_name = st.multiselect('(Optional) SLA policy name to filter', filter_options('sla_policy_name', 'sla'), default=None)
     with opt2:
-        selected_metric = st.multiselect('(Optional) SLA metric to filter', data_ref['metric'].unique(), default=None)
+        selected_metric = st.multiselect('(Optional) SLA metric to filter', filter_options('metric', 'sla'), default=None)
     with opt3:
-        selected_group = st.multiselect('(Optional) Groups to filter', data_ref['ticket_group'].unique(), default=None)
+        selected_group = st.multiselect('(Optional) Groups to filter', filter_options('ticket_group', 'sla'), default=None)
 
     opt4, opt5, opt6 = st.columns(3)
     with opt4:
-        selected_req_organizations = st.multiselect('(Optional) Requester orgs to filter', data_ref['requester_organization'].unique(), default=None)
+        selected_req_organizations = st.multiselect('(Optional) Requester orgs to filter', filter_options('requester_organization', 'sla'), default=None)
     with opt5:
-        selected_brands = st.multiselect('(Optional) Brands to filter', data_ref['ticket_brand'].unique(), default=None)
+        selected_brands = st.multiselect('(Optional) Brands to filter', filter_options('ticket_brand', 'sla'), default=None)
     with opt6:
-        selected_forms = st.multiselect('(Optional) Forms to filter', data_ref['ticket_form'].unique(), default=None)
+        selected_forms = st.multiselect('(Optional) Forms to filter', filter_options('ticket_form', 'sla'), default=None)
 
     filter_dict = {'sla_policy_name': selected_sla_name, 'metric': selected_metric, 'ticket_group': selected_group, 'requester_organization': selected_req_organizations,'ticket_brand': selected_brands, 'ticket_form': selected_forms}
     
     return filter_dict, selected_sla_name, selected_metric, selected_group, selected_req_organizations, selected_brands, selected_forms
 
-def filter_data(start, end, data_ref, filter_dictionary, model='ticket'):
-    if model == "ticket":
-        data_date_filtered = data_ref.query("`created_at` >= @start and `created_at` <= @end")
-    elif model == "sla": 
-        data_date_filtered = data_ref.query("`sla_applied_at` >= @start and `sla_applied_at` <= @end")
-        
-    for k, v in filter_dictionary.items():
-        if len(v) == 0 or None in v:
-            data_date_filtered = data_date_filtered
+# Per dataset filter indexes (day numbers and dimension codes), built once per loaded DataFrame
+# and dropped together with it.
+filter_indexes = {}
+
+def filter_index(data_ref):
+    key = id(data_ref)
+    if key not in filter_indexes:
+        filter_indexes[key] = {}
+        weakref.finalize(data_ref, filter_indexes.pop, key, None)
+    return filter_indexes[key]
+
+def index_size(value):
+    # Filter indexes, cubes, sketches and leaderboards built for a DataFrame, and the indexes of the cubes
+    # in turn.
+    parts = list(filter_indexes.get(id(value), {}).values())
+    size = value_size(parts)
+    for part in parts:
+        for item in part if isinstance(part, tuple) else (part,):
+            if isinstance(item, pd.DataFrame):
+                size += index_size(item)
+    return size
+
+# Cached datasets are accounted with their indexes.
+size_hooks.append(index_size)
+
+# Dataset every derived DataFrame, like a cube, was built from, so the indexes of the cube are accounted
+# with the cached dataset.
+index_owners = {}
+
+def store_index(data_ref, key, value):
+    # Indexes can outweigh their dataset, the cached dataset they were built from is accounted with them and
+    # the cache budget is checked again.
+    index = filter_index(data_ref)
+    size = value_size(value) - value_size(index.get(key))
+    index[key] = value
+    owner = index_owners.get(id(data_ref), weakref.ref(data_ref))
+    for item in value if isinstance(value, tuple) else (value,):
+        if isinstance(item, pd.DataFrame):
+            index_owners[id(item)] = owner
+            weakref.finalize(item, index_owners.pop, id(item), None)
+    dataset_cache().grow(owner(), size)
+    return value
+
+# Day number of missing dates: the largest int32, so they sort last and are never inside a date range.
+missing_day = np.iinfo(np.int32).max
+
+def day_number(value):
+    return np.datetime64(value, 'D').astype(np.int64)
+
+def column_days(data_ref, column):
+    index = filter_index(data_ref)
+    if ('days', column) not in index:
+        dates = pd.to_datetime(data_ref[column]).values.astype('datetime64[D]')
+        days = np.full(len(dates), missing_day, dtype=np.int32)
+        present = ~np.isnat(dates)
+        days[present] = dates[present].astype(np.int64)
+        store_index(data_ref, ('days', column), days)
+    return index[('days', column)]
+
+def day_offsets(data_ref, column):
+    # Day -> row offset index of a dataset sorted by the column: the first day and, for every day from it to
+    # one past the last day, the position of its first row. None when the rows are not sorted by day.
+    index = filter_index(data_ref)
+    if ('offsets', column) not in index:
+        days = column_days(data_ref, column)
+        if len(days) == 0 or np.any(days[1:] < days[:-1]):
+            store_index(data_ref, ('offsets', column), None)
+        else:
+            dated = int(np.searchsorted(days, missing_day))
+            first = int(days[0]) if dated > 0 else 0
+            last = int(days[dated - 1]) if dated > 0 else -1
+            offsets = np.searchsorted(days[:dated], np.arange(first, last + 2))
+            store_index(data_ref, ('offsets', column), (first, offsets))
+    return index[('offsets', column)]
+
+def day_slice(data_ref, column, start, end):
+    # Row slice of the date range in a day sorted dataset, from two offset lookups. None when not sorted.
+    day_index = day_offsets(data_ref, column)
+    if day_index is None:
+        return None
+    first, offsets = day_index
+    start_row = offsets[np.clip(day_number(start) - first, 0, len(offsets) - 1)]
+    end_row = offsets[np.clip(day_number(end) + 1 - first, 0, len(offsets) - 1)]
+    return slice(int(start_row), int(max(start_row, end_row)))
+
+def column_codes(data_ref, column):
+    index = filter_index(data_ref)
+    if ('codes', column) not in index:
+        if isinstance(data_ref[column].dtype, pd.CategoricalDtype):
+            # Categorical columns already carry their codes.
+            codes, categories = data_ref[column].cat.codes.values, data_ref[column].cat.categories
         else:
-            list_var = []
-            for i in v:
-                list_var.append(i)
-            list_var_tuple = tuple(list_var)
-            data_date_filtered = data_date_filtered.query(f"`{k}` in {list_var_tuple}")
+            codes, categories = pd.factorize(data_ref[column])
+        store_index(data_ref, ('codes', column), (codes, pd.Index(categories)))
+    return index[('codes', column)]
+
+def end_midnight_rows(data_ref, column, end):
+    # Number of rows of a day sorted dataset applied exactly at the midnight of the end date, the first rows of
+    # that day.
+    values = data_ref[column].values[day_slice(data_ref, column, end, end)]
+    return int(np.searchsorted(values, pd.Timestamp(end).to_datetime64().astype(values.dtype), side='right'))
+
+def filter_positions(start, end, data_ref, filter_dictionary, model='ticket'):
+    # Combines the date range and every active filter and returns the matching row positions. On day sorted
+    # data the date range is a slice, returned as is without filters, and the filters only scan its rows.
+    # Tickets are filtered by creation day. SLAs compare the sla_applied_at timestamp with the dates, so the
+    # end date only includes the SLAs applied exactly at its midnight.
+    day_column = 'created_at' if model == "ticket" else 'sla_applied_at'
+    last = end if model == "ticket" else end - timedelta(days=1)
+    window = day_slice(data_ref, day_column, start, last)
+    active = {k: v for k, v in filter_dictionary.items() if len(v) > 0 and None not in v}
+
+    if window is None:
+        days = column_days(data_ref, day_column)
+        mask = (days >= day_number(start)) & (days <= day_number(last))
+        if model != "ticket" and end >= start:
+            mask |= pd.to_datetime(data_ref[day_column]).values == pd.Timestamp(end).to_datetime64()
+        window = slice(0, len(data_ref))
+    else:
+        if model != "ticket" and end >= start:
+            window = slice(window.start, window.stop + end_midnight_rows(data_ref, day_column, end))
+        if len(active) == 0:
+            return window
+        mask = np.ones(window.stop - window.start, dtype=bool)
+
+    for k, v in active.items():
+        codes, categories = column_codes(data_ref, k)
+        # Lookup table of selected codes. Missing values are coded -1 and hit the extra, always False, last slot.
+        allowed = np.zeros(len(categories) + 1, dtype=bool)
+        selected = categories.get_indexer(list(v))
+        allowed[selected[selected >= 0]] = True
+        mask &= allowed[codes[window]]
+
+    return window.start + np.flatnonzero(mask)
 
-    return data_date_filtered
\ No newline at end of file
+def filter_data(start, end, data_ref, filter_dictionary, model='ticket'):
+    # In pushdown mode dataset_rows already applied the date range and filters in the warehouse, filtering
+    # again is a slice of the whole frame, and applies the filters that could not be pushed down.
+    with stage('filter', model) as fields:
+        data = data_ref.iloc[filter_positions(start, end, data_ref, filter_dictionary, model)]
+        fields['rows'] = len(data)
+    return data
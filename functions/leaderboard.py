@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+import streamlit as st
+from functions.cache import dataset_cache, value_size
+from functions.filters import filter_index, filter_positions
+from functions.sketch import approximate_quantile
+from functions.query import filter_key
+from functions.profiling import stage
+
+# Assignee activity leaderboard: solved tickets and median metrics (in hours) per assignee.
+median_columns = {
+    'first_reply_time_median': 'first_reply_time_calendar_minutes',
+    'requester_wait_time_median': 'requester_wait_time_in_calendar_minutes',
+    'last_assignment_resolution_time_median': 'last_assignment_to_resolution_calendar_minutes',
+    'final_resolution_time_median': 'final_resolution_calendar_minutes'
+}
+leaderboard_columns = ['assignee_name', 'solved_tickets_count'] + list(median_columns)
+
+# Leaderboards kept per loaded dataset, for the most recent date range, filter and sort combinations.
+leaderboard_cache_entries = 16
+leaderboard_lock = threading.Lock()
+
+def assignee_stats(start, end, data_ref, filter_dictionary, approximate=False):
+    # Solved tickets are counted from the rows, assignees have no cube.
+    rows = data_ref.iloc[filter_positions(start, end, data_ref, filter_dictionary)]
+    assignees = rows['assignee_name']
+    stats = (rows['status'] == 'solved').groupby(assignees, observed=True).sum().rename('solved_tickets_count').to_frame()
+    if approximate:
+        # Medians from the merged quantile sketches.
+        for name, column in median_columns.items():
+            stats[name] = (approximate_quantile(start, end, data_ref, filter_dictionary, column, by='assignee_name') / 60).round(2)
+    else:
+        # One grouped median over all metric columns, no per group Python calls.
+        # Minute metrics are stored as float32, take the medians in float64 so the table shows clean values.
+        medians = rows[list(median_columns.values())].astype('float64').groupby(assignees, observed=True).median()
+        for name, column in median_columns.items():
+            stats[name] = (medians[column] / 60).round(2)
+    return stats.reset_index()
+
+def sort_leaderboard(stats, sort_column='assignee_name', ascending=True):
+    # Missing medians always sort last.
+    return stats.sort_values(sort_column, ascending=ascending, kind='stable', na_position='last', ignore_index=True)
+
+def cached_value(data_ref, cache, key, compute):
+    with leaderboard_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = compute()
+    with leaderboard_lock:
+        size = value_size(value) - value_size(cache.get(key))
+        cache[key] = value
+        while len(cache) > leaderboard_cache_entries:
+            size -= value_size(cache.popitem(last=False)[1])
+    # Leaderboards count against the cache budget with their dataset.
+    dataset_cache().grow(data_ref, size)
+    return value
+
+def leaderboard(start, end, data_ref, filter_dictionary, sort_column='assignee_name', ascending=True, approximate=False):
+    # The stats and each sort order are cached with the dataset by date range and filters, so reruns for
+    # paging or re-sorting do not regroup the tickets.
+    with leaderboard_lock:
+        cache = filter_index(data_ref).setdefault('leaderboards', OrderedDict())
+    key = (start, end, filter_key(filter_dictionary), approximate)
+    with stage('aggregate', 'assignee leaderboard') as fields:
+        stats = cached_value(data_ref, cache, key, lambda: assignee_stats(start, end, data_ref, filter_dictionary, approximate))
+        ranked = cached_value(data_ref, cache, key + (sort_column, ascending), lambda: sort_leaderboard(stats, sort_column, ascending))
+        fields['rows'] = len(ranked)
+    return ranked
+
+def change_page(step):
+    # Button callback: the page changes before the rerun renders the table.
+    st.session_state.page = st.session_state.get('page', 0) + step
+
+def reset_page():
+    st.session_state.page = 0
@@ -0,0 +1,74 @@
+import re
+import csv
+import itertools
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# Rows per Parquet batch and bytes per CSV block read at a time.
+parquet_batch_size = 256 * 1024
+csv_block_size = 64 * 1024 ** 2
+# CSV rows looked at to tell whether a timestamp column carries a zone offset.
+csv_sniff_rows = 1000
+zone_offset = re.compile(r'\d:\d\d(:\d\d(\.\d+)?)?\s*(Z|[+-]\d\d(:?\d\d)?)$')
+
+def file_columns(path):
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).schema_arrow.names
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
+
+def zoned_columns(path, columns):
+    # Timestamp columns whose first non empty value ends with a zone offset (like 2023-08-02 18:24:05+00:00).
+    zoned, seen = set(), set()
+    with open(path, newline='') as f:
+        for row in itertools.islice(csv.DictReader(f), csv_sniff_rows):
+            for column in columns:
+                value = (row.get(column) or '').strip()
+                if column not in seen and value != '':
+                    seen.add(column)
+                    if zone_offset.search(value):
+                        zoned.add(column)
+            if len(seen) == len(columns):
+                break
+    return zoned
+
+def encode_batch(batch, categories):
+    # Dictionary encode the dimension columns of each batch so their strings are only held once per chunk.
+    for column in categories:
+        if column in batch.schema.names and not pa.types.is_dictionary(batch.schema.field(column).type):
+            i = batch.schema.get_field_index(column)
+            batch = batch.set_column(i, column, pc.dictionary_encode(batch.column(column)))
+    return batch
+
+def file_batches(path, columns, column_types):
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).iter_batches(batch_size=parquet_batch_size, columns=columns)
+
+    # CSV through the pyarrow streaming reader: only the projected columns are parsed, with explicit types,
+    # and dates are parsed while reading. Arrow rejects zone offsets in naive timestamp columns, so timestamps
+    # exported with an offset are read as UTC, load_results drops the zone.
+    column_types = {c: t for c, t in column_types.items() if c in columns}
+    timestamps = [c for c, t in column_types.items() if pa.types.is_timestamp(t) and t.tz is None]
+    for column in zoned_columns(path, timestamps):
+        column_types[column] = pa.timestamp(column_types[column].unit, tz='UTC')
+    convert_options = pv.ConvertOptions(
+        include_columns=columns,
+        column_types=column_types,
+        strings_can_be_null=True
+    )
+    return pv.open_csv(path, read_options=pv.ReadOptions(block_size=csv_block_size), convert_options=convert_options)
+
+def read_model_file(path, columns, column_types, categories=()):
+    # Reads a local Parquet or CSV export of a model chunk by chunk and returns a DataFrame of the requested columns.
+    # Dimension columns are kept dictionary encoded until pandas turns them into categoricals, and Arrow buffers
+    # are released while converting, so loading does not hold a full string copy next to the DataFrame.
+    available = file_columns(path)
+    columns = [c for c in columns if c in available]
+    batches = [encode_batch(batch, categories) for batch in file_batches(path, columns, column_types)]
+    if len(batches) == 0:
+        return pa.table({c: pa.array([], type=pa.string()) for c in columns}).to_pandas()
+    table = pa.Table.from_batches(batches).unify_dictionaries()
+    del batches
+    return table.to_pandas(self_destruct=True, split_blocks=True)
@@ -0,0 +1,44 @@
+import os
+import itertools
+import threading
+import streamlit as st
+from functions.cache import DatasetCache, cache_ttl, dataset_cache
+from functions.filters import filter_index
+from functions.query import filter_key
+
+# Chart and KPI results of the pages, shared by every session: sessions showing the same chart of the same
+# loaded dataset, date range and filters get the result computed by the first one instead of regrouping the
+# rows. Results are only kept while their dataset is loaded, a reloaded dataset gets a new version. They are
+# part of the dataset cache budget, up to their own limit.
+result_cache_max_entries = int(os.environ.get('ZENDESK_RESULT_CACHE_MAX_ENTRIES', 512))
+result_cache_max_bytes = int(os.environ.get('ZENDESK_RESULT_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+
+versions = itertools.count(1)
+version_lock = threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def result_cache():
+    cache = DatasetCache(cache_ttl, result_cache_max_entries, result_cache_max_bytes)
+    dataset_cache().shared.append(cache)
+    return cache
+
+def dataset_version(data_ref):
+    # Numbered once per loaded DataFrame, unlike id() the number is never reused for a later dataset.
+    with version_lock:
+        index = filter_index(data_ref)
+        if 'version' not in index:
+            index['version'] = next(versions)
+        return index['version']
+
+def page_result(chart, data_ref, start, end, filter_dictionary, compute, params=(), model='ticket'):
+    # compute() for the chart over the dataset, date range and filters, plus any other params it depends on
+    # (selected attribute, granularity). Results must not be modified by the caller. Without rows (aggregate
+    # mode) the warehouse results are already shared through the dataset cache, and compute() is called as is.
+    if data_ref is None:
+        return compute()
+    key = (dataset_version(data_ref), model, 'result', chart, start, end, filter_key(filter_dictionary)) + tuple(params)
+    result = result_cache().get_or_load(key, compute)
+    if dataset_cache().over_budget():
+        # New results can take the datasets over the shared budget.
+        dataset_cache().trim()
+    return result
@@ -0,0 +1,54 @@
+import pandas as pd
+from functions.cache import dataset_cache
+from functions.query import model_columns, date_columns, from_clause, fetch_results, result_frame, dataset_key, query_results
+from functions.workers import submit
+
+# Dataset metadata for the filter bar: the date bounds of a model and the distinct values of each filter
+# dimension with their row counts. It is cached on its own, apart from the rows, so the date and optional
+# filters render without (aggregate and pushdown modes) or before (local mode) loading the model.
+filter_columns = {
+    'ticket': ['ticket_group', 'ticket_brand', 'ticket_channel', 'ticket_form', 'submitter_role', 'requester_organization', 'assignee_name'],
+    'sla': ['sla_policy_name', 'metric', 'ticket_group', 'requester_organization', 'ticket_brand', 'ticket_form']
+}
+
+def data_metadata(data, model):
+    # Metadata of an already loaded model.
+    day_column = 'created_at' if model == 'ticket' else 'sla_applied_at'
+    days = data[day_column].dropna()
+    values = {}
+    for column in filter_columns[model]:
+        counts = data[column].value_counts(sort=False)
+        values[column] = counts[counts > 0].sort_index().rename('row_count').rename_axis(column)
+    return {'min_date': days.min().date(), 'max_date': days.max().date(), 'values': values}
+
+def warehouse_metadata(destination, database, schema, model):
+    # Two small queries, run at the same time: the date bounds, and every filter dimension's value counts in one union.
+    source = from_clause(destination, database, schema, model)
+    day = "cast(" + date_columns[model] + " as date)"
+    bounds = submit(fetch_results, destination, "select min(" + day + ") as min_date, max(" + day + ") as max_date " + source)
+
+    selects = []
+    for column in filter_columns[model]:
+        expression = model_columns[model][column]
+        selects.append("select '" + column + "' as dimension, cast(" + expression + " as string) as value, count(*) as row_count " + source + " where " + expression + " is not null group by 1, 2")
+    counts = result_frame(fetch_results(destination, " union all ".join(selects) + " order by 1, 2"), ['dimension', 'value', 'row_count'])
+    bounds = result_frame(bounds.result(), ['min_date', 'max_date']).iloc[0]
+
+    values = {}
+    for column in filter_columns[model]:
+        rows = counts[counts['dimension'] == column]
+        values[column] = pd.Series(rows['row_count'].astype('int64').values, index=pd.Index(rows['value'].values, name=column), name='row_count')
+    return {'min_date': pd.Timestamp(bounds['min_date']).date(), 'max_date': pd.Timestamp(bounds['max_date']).date(), 'values': values}
+
+def dataset_metadata(destination, database, schema, model='ticket'):
+    def load():
+        # Derived from the full model when it is already cached, otherwise queried. The sample data has
+        # no warehouse, its files are loaded.
+        entry = dataset_cache().lookup(dataset_key(destination, database, schema, model))
+        if entry is not None:
+            return data_metadata(entry[2], model)
+        if destination == "Dunder Mifflin Sample Data":
+            return data_metadata(query_results(destination, database, schema, model), model)
+        return warehouse_metadata(destination, database, schema, model)
+
+    return dataset_cache().get_or_load((destination, database, schema, model, 'metadata'), load)
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+# Stage timings for finding out why a dashboard is slow. Switched on for every session by ZENDESK_PROFILE,
+# or for one session with the ?profile=true query param. A page run records its fetch, convert, filter,
+# aggregate and page section stages and the dataset cache hits and misses, and shows them in a collapsible
+# panel at the bottom of the page. The records of each run are also logged as one JSON line to the
+# zendesk.profile logger, and appended to the ZENDESK_PROFILE_LOG file when it is set.
+profile_all = os.environ.get('ZENDESK_PROFILE', '').lower() in ('1', 'true', 'yes')
+profile_log = os.environ.get('ZENDESK_PROFILE_LOG')
+logger = logging.getLogger('zendesk.profile')
+log_lock = threading.Lock()
+
+# The run being profiled on this thread, None when profiling is off. Streamlit executes a script run, and the
+# cache loads it triggers, on one thread.
+current = threading.local()
+
+def start_profiling(page):
+    enabled = profile_all or st.query_params.get('profile', 'false').lower() == 'true'
+    current.run = {'page': page, 'started_at': time.time(), 'start': time.perf_counter(), 'records': [], 'section': None} if enabled else None
+    return enabled
+
+def active_run():
+    return getattr(current, 'run', None)
+
+def result_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, pa.Table)):
+        return len(value)
+    return None
+
+def add_record(run, name, detail, start, seconds, fields):
+    run['records'].append(dict({'stage': name, 'detail': detail, 'start': start - run['start'], 'seconds': seconds}, **fields))
+
+@contextmanager
+def stage(name, detail=None):
+    # Times the block. Extra record fields (rows, cache) can be set on the yielded dict.
+    run = active_run()
+    fields = {}
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        if run is not None:
+            add_record(run, name, detail, start, time.perf_counter() - start, fields)
+
+def record(name, detail=None, **fields):
+    # An instant event, like a cache hit.
+    run = active_run()
+    if run is not None:
+        add_record(run, name, detail, time.perf_counter(), 0.0, fields)
+
+def cache_detail(key):
+    # Readable part of a dataset cache key: the model and what was asked for, without the connection.
+    return ' '.join(str(part) for part in key[3:] if part not in (None, ()))[:120]
+
+def end_section(run):
+    if run['section'] is not None:
+        name, start = run['section']
+        add_record(run, 'section', name, start, time.perf_counter() - start, {})
+        run['section'] = None
+
+def page_section(name):
+    # Ends the previous page section and starts the next one, so each part of a page is timed with one call.
+    run = active_run()
+    if run is not None:
+        end_section(run)
+        run['section'] = (name, time.perf_counter())
+
+def write_records(payload):
+    line = json.dumps(payload, default=str)
+    logger.info(line)
+    if profile_log:
+        with log_lock:
+            with open(profile_log, 'a') as f:
+                f.write(line + '\n')
+
+def profile_panel():
+    run = active_run()
+    if run is None:
+        return
+    end_section(run)
+    total = time.perf_counter() - run['start']
+    current.run = None
+
+    records = pd.DataFrame(run['records'], columns=['stage', 'detail', 'start', 'seconds', 'rows', 'cache']).sort_values('start', kind='stable')
+    payload = {'page': run['page'], 'started_at': run['started_at'], 'total_seconds': total, 'records': run['records']}
+    write_records(payload)
+
+    with st.expander(f'Profiling: {total:.3f}s'):
+        st.caption('Stage times in seconds. Sections include the stages run inside them.')
+        summary = records.groupby('stage', sort=False).agg(count=('seconds', 'size'), seconds=('seconds', 'sum'))
+        summary['cache hits'] = records.groupby('stage', sort=False)['cache'].agg(lambda c: int((c == 'hit').sum()))
+        st.dataframe(summary, use_container_width=True)
+        st.dataframe(records.round({'start': 4, 'seconds': 4}), hide_index=True, use_container_width=True)
+        st.download_button('Download JSON', json.dumps(payload, default=str, indent=2), file_name='profile_' + run['page'] + '.json', mime='application/json')
@@ -1,168 +1,436 @@
+import os
+import numpy as np
 import streamlit as st
 import pandas as pd
-from google.oauth2 import service_account
+import pyarrow as pa
+import pyarrow.compute as pc
 from google.cloud import bigquery
+from functions.cache import dataset_cache
+from functions.connections import warehouse_pool
+from functions.workers import submit
+from functions.disk_cache import disk_cache_enabled, cache_path, read_cache, write_cache, merge_rows
+from functions.local_files import read_model_file
+from functions.profiling import stage, result_rows
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # Grab global variables
-destination = st.session_state.destination
-database = st.session_state.database 
-schema = st.session_state.schema
-
-# Perform query.
-# Uses st.cache_data to only rerun when the query changes or after 10 min.
-@st.cache_data(ttl=600)
-def run_query(query):
-    # Create API client.
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    client = bigquery.Client(credentials=credentials)
-    query_job = client.query(query)
-    rows_raw = query_job.result()
-    # Convert to list of dicts. Required for st.cache_data to hash the return value.
-    rows = [dict(row) for row in rows_raw]
-    return rows
-
-def query_results(destination, database, schema, model='ticket'):
-    if destination == "BigQuery" and model == "ticket":
-        query = run_query(
-            "select "\
-                "ticket_id,"\
-                "created_at,"\
-                "cast(created_at as timestamp) as created_timestamp,"\
-                "status,"\
-                "first_solved_at,"\
-                "ticket_brand_name as ticket_brand,"\
-                "created_channel as ticket_channel,"\
-                "ticket_form_name as ticket_form,"\
-                "group_name as ticket_group,"\
-                "priority as ticket_priority,"\
-                "type as ticket_type,"\
-                "submitter_role,"\
-                "requester_organization_name as requester_organization,"\
-                "is_one_touch_resolution,"\
-                "is_two_touch_resolution,"\
-                "is_multi_touch_resolution,"\
-                "first_assignment_to_resolution_calendar_minutes,"\
-                "requester_wait_time_in_calendar_minutes,"\
-                "ticket_satisfaction_score,"\
-                "first_reply_time_calendar_minutes,"\
-                "last_assignment_to_resolution_calendar_minutes,"\
-                "final_resolution_calendar_minutes,"\
-                "assignee_name "\
-            "from `" + database + "." + schema + ".zendesk__ticket_metrics`"
-        )
-    elif destination == "Snowflake" and model == "ticket":
-        conn = st.experimental_connection('snowpark')
-        query_job = conn.query(
-            "select "\
-                "ticket_id,"\
-                "created_at,"\
-                "cast(created_at as timestamp) as created_timestamp,"\
-                "status,"\
-                "first_solved_at,"\
-                "ticket_brand_name as ticket_brand,"\
-                "created_channel as ticket_channel,"\
-                "ticket_form_name as ticket_form,"\
-                "group_name as ticket_group,"\
-                "priority as ticket_priority,"\
-                "type as ticket_type,"\
-                "submitter_role,"\
-                "requester_organization_name as requester_organization,"\
-                "is_one_touch_resolution,"\
-                "is_two_touch_resolution,"\
-                "is_multi_touch_resolution,"\
-                "first_assignment_to_resolution_calendar_minutes,"\
-                "requester_wait_time_in_calendar_minutes,"\
-                "ticket_satisfaction_score,"\
-                "first_reply_time_calendar_minutes,"\
-                "last_assignment_to_resolution_calendar_minutes,"\
-                "final_resolution_calendar_minutes,"\
-                "assignee_name "\
-            "from " + database + "." + schema + ".zendesk__ticket_metrics"
-        )
-        raw_results = query_job.result()
-        # Convert to list of dicts. Required for st.cache_data to hash the return value.
-        query = [dict(row) for row in raw_results]
-
-    elif destination == "BigQuery" and model == "sla":
-        query = run_query(
-            "select "\
-                "sla.sla_event_id, "\
-                "sla.ticket_id, "\
-                "sla.sla_policy_name, "\
-                "sla.metric, "\
-                "sla.sla_applied_at, "\
-                "sla.target, "\
-                "sla.in_business_hours, "\
-                "sla.sla_breach_at, "\
-                "sla.sla_elapsed_time, "\
-                "sla.is_active_sla, "\
-                "sla.is_sla_breach, "\
-                "ticket.group_name as ticket_group, "\
-                "ticket.ticket_brand_name as ticket_brand, "\
-                "ticket.ticket_form_name as ticket_form, "\
-                "ticket.requester_organization_name as requester_organization, "\
-                "ticket.created_channel as ticket_channel "\
-        "from " + database + "." + schema + ".zendesk__sla_policies as sla "\
-        "left join " + database + "." + schema + ".zendesk__ticket_metrics as ticket "\
-            "on sla.ticket_id = ticket.ticket_id "
-        )
-
-    elif destination == "Snowflake" and model == "sla":
-        conn = st.experimental_connection('snowpark')
-        query_job = conn.query(
-            "select "\
-                "sla.sla_event_id, "\
-                "sla.ticket_id, "\
-                "sla.sla_policy_name, "\
-                "sla.metric, "\
-                "sla.sla_applied_at, "\
-                "sla.target, "\
-                "sla.in_business_hours, "\
-                "sla.sla_breach_at, "\
-                "sla.sla_elapsed_time, "\
-                "sla.is_active_sla, "\
-                "sla.is_sla_breach, "\
-                "ticket.group_name as ticket_group, "\
-                "ticket.ticket_brand_name as ticket_brand, "\
-                "ticket.ticket_form_name as ticket_form, "\
-                "ticket.requester_organization_name as requester_organization, "\
-                "ticket.created_channel as ticket_channel "\
-        "from " + database + "." + schema + ".zendesk__sla_policies as sla "\
-        "left join " + database + "." + schema + ".zendesk__ticket_metrics as ticket "\
-            "on sla.ticket_id = ticket.ticket_id "
-        )
-        raw_results = query_job.result()
-        # Convert to list of dicts. Required for st.cache_data to hash the return value.
-        query = [dict(row) for row in raw_results]
-
-    elif destination == "Dunder Mifflin Sample Data" and model == "ticket":
-        query = pd.read_csv('data/dunder_mifflin_tickets.csv')
-
-    elif destination == "Dunder Mifflin Sample Data" and model == "sla":
-        query = pd.read_csv('data/dunder_mifflin_slas.csv')
+destination = st.session_state.get("destination")
+database = st.session_state.get("database")
+schema = st.session_state.get("schema")
 
+# Output column name -> warehouse expression for each model.
+ticket_columns = {
+    'ticket_id': 'ticket_id',
+    'created_at': 'created_at',
+    'created_timestamp': 'cast(created_at as timestamp)',
+    'status': 'status',
+    'first_solved_at': 'first_solved_at',
+    'ticket_brand': 'ticket_brand_name',
+    'ticket_channel': 'created_channel',
+    'ticket_form': 'ticket_form_name',
+    'ticket_group': 'group_name',
+    'ticket_priority': 'priority',
+    'ticket_type': 'type',
+    'submitter_role': 'submitter_role',
+    'requester_organization': 'requester_organization_name',
+    'is_one_touch_resolution': 'is_one_touch_resolution',
+    'is_two_touch_resolution': 'is_two_touch_resolution',
+    'is_multi_touch_resolution': 'is_multi_touch_resolution',
+    'first_assignment_to_resolution_calendar_minutes': 'first_assignment_to_resolution_calendar_minutes',
+    'requester_wait_time_in_calendar_minutes': 'requester_wait_time_in_calendar_minutes',
+    'ticket_satisfaction_score': 'ticket_satisfaction_score',
+    'first_reply_time_calendar_minutes': 'first_reply_time_calendar_minutes',
+    'last_assignment_to_resolution_calendar_minutes': 'last_assignment_to_resolution_calendar_minutes',
+    'final_resolution_calendar_minutes': 'final_resolution_calendar_minutes',
+    'assignee_name': 'assignee_name'
+}
+
+sla_columns = {
+    'sla_event_id': 'sla.sla_event_id',
+    'ticket_id': 'sla.ticket_id',
+    'sla_policy_name': 'sla.sla_policy_name',
+    'metric': 'sla.metric',
+    'sla_applied_at': 'sla.sla_applied_at',
+    'target': 'sla.target',
+    'in_business_hours': 'sla.in_business_hours',
+    'sla_breach_at': 'sla.sla_breach_at',
+    'sla_elapsed_time': 'sla.sla_elapsed_time',
+    'is_active_sla': 'sla.is_active_sla',
+    'is_sla_breach': 'sla.is_sla_breach',
+    'ticket_group': 'ticket.group_name',
+    'ticket_brand': 'ticket.ticket_brand_name',
+    'ticket_form': 'ticket.ticket_form_name',
+    'requester_organization': 'ticket.requester_organization_name',
+    'ticket_channel': 'ticket.created_channel'
+}
+
+# Ticket dimensions the SLA model takes from the ticket model.
+ticket_dimension_columns = ['ticket_group', 'ticket_brand', 'ticket_form', 'requester_organization', 'ticket_channel']
+
+# The SLA facts alone, read without joining the ticket model.
+sla_fact_columns = {column: expression for column, expression in sla_columns.items() if column not in ticket_dimension_columns}
+
+model_columns = {'ticket': ticket_columns, 'sla': sla_columns, 'sla_fact': sla_fact_columns}
+
+# Column used by the date range filter for each model.
+date_columns = {'ticket': 'created_at', 'sla': 'sla.sla_applied_at', 'sla_fact': 'sla.sla_applied_at'}
+
+# Column tracking new or changed rows for the incremental disk cache refresh, and the key used to merge them.
+watermark_columns = {'ticket': 'updated_at', 'sla': 'sla.sla_applied_at', 'sla_fact': 'sla.sla_applied_at'}
+key_columns = {'ticket': 'ticket_id', 'sla': 'sla_event_id', 'sla_fact': 'sla_event_id'}
+
+# When set, warehouse SLA queries skip the join to the ticket model and the ticket dimensions are joined
+# locally from the cached ticket data instead.
+sla_local_join = os.environ.get('ZENDESK_SLA_LOCAL_JOIN', '').lower() in ('1', 'true', 'yes')
+
+# Dtypes applied once at load time so the cached and per session copies stay small.
+category_columns = {
+    'ticket': ['status', 'ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group', 'ticket_priority', 'ticket_type', 'submitter_role', 'requester_organization', 'ticket_satisfaction_score', 'assignee_name'],
+    'sla': ['sla_policy_name', 'metric', 'ticket_group', 'ticket_brand', 'ticket_form', 'requester_organization', 'ticket_channel']
+}
+flag_columns = {
+    'ticket': ['is_one_touch_resolution', 'is_two_touch_resolution', 'is_multi_touch_resolution'],
+    'sla': ['in_business_hours', 'is_active_sla', 'is_sla_breach']
+}
+minute_columns = {
+    'ticket': ['first_assignment_to_resolution_calendar_minutes', 'requester_wait_time_in_calendar_minutes', 'first_reply_time_calendar_minutes', 'last_assignment_to_resolution_calendar_minutes', 'final_resolution_calendar_minutes'],
+    'sla': ['target', 'sla_elapsed_time']
+}
+
+timestamp_columns = {
+    'ticket': ['created_at', 'created_timestamp', 'first_solved_at'],
+    'sla': ['sla_applied_at', 'sla_breach_at']
+}
+
+model_tables = {'ticket': 'zendesk__ticket_metrics', 'sla': 'zendesk__sla_policies'}
+
+def data_dir_files(data_dir):
+    # Model exports in a directory, Parquet preferred over CSV.
+    files = {}
+    for model, table in model_tables.items():
+        parquet_path = os.path.join(data_dir, table + '.parquet')
+        files[model] = parquet_path if os.path.exists(parquet_path) else os.path.join(data_dir, table + '.csv')
+    return files
+
+# Files backing the sample data destination. ZENDESK_DATA_DIR replaces them with a directory of exported
+# zendesk__ticket_metrics / zendesk__sla_policies Parquet or CSV files (the benchmarks use the same mechanism).
+if os.environ.get('ZENDESK_DATA_DIR'):
+    sample_files = data_dir_files(os.environ['ZENDESK_DATA_DIR'])
+else:
+    sample_files = {'ticket': 'data/dunder_mifflin_tickets.csv', 'sla': 'data/dunder_mifflin_slas.csv'}
+
+def file_column_types(model):
+    # Explicit Arrow types for the local file loader, so nothing is inferred and dates are parsed while reading.
+    types = {c: pa.dictionary(pa.int32(), pa.string()) for c in category_columns[model]}
+    types.update({c: pa.bool_() for c in flag_columns[model]})
+    types.update({c: pa.float64() for c in minute_columns[model]})
+    types.update({c: pa.timestamp('us') for c in timestamp_columns[model]})
+    return types
+
+weekday_order = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+def duckdb_source(directory, table):
+    # A DuckDB "table" is a Parquet snapshot in the chosen directory, either one file or a folder of
+    # (possibly hive partitioned) files.
+    path = os.path.join(directory, table)
+    if os.path.isdir(path):
+        path = os.path.join(path, '**', '*.parquet')
+    else:
+        path = path + '.parquet'
+    return "read_parquet('" + path.replace("'", "''") + "')"
+
+def table_name(destination, database, schema, table):
+    if destination == "BigQuery":
+        return "`" + database + "." + schema + "." + table + "`"
+    if destination == "DuckDB":
+        return duckdb_source(database, table)
+    return database + "." + schema + "." + table
+
+def from_clause(destination, database, schema, model):
     if model == 'ticket':
-        data = pd.DataFrame(query, columns=['ticket_id','created_at','created_timestamp','status','first_solved_at','ticket_brand','ticket_channel','ticket_form','ticket_group','ticket_priority','ticket_type','submitter_role','requester_organization','is_one_touch_resolution','is_two_touch_resolution','is_multi_touch_resolution','first_assignment_to_resolution_calendar_minutes','requester_wait_time_in_calendar_minutes','ticket_satisfaction_score','first_reply_time_calendar_minutes','last_assignment_to_resolution_calendar_minutes','final_resolution_calendar_minutes','assignee_name'])
-        # Get the data into the app and specify any datatypes if needed.
-        data_load_state = st.text('Loading data...')
-        data['created_at'] = pd.to_datetime(data['created_at'])
-        data['first_solved_at'] = pd.to_datetime(data['first_solved_at'])
-        data['created_at'] = data['created_at'].dt.date
-        data['first_solved_at'] = data['first_solved_at'].dt.date
-        data_load_state.text("Done! (using st.cache_data)")
+        return "from " + table_name(destination, database, schema, 'zendesk__ticket_metrics')
+    if model == 'sla_fact':
+        return "from " + table_name(destination, database, schema, 'zendesk__sla_policies') + " as sla"
+    return "from " + table_name(destination, database, schema, 'zendesk__sla_policies') + " as sla "\
+        "left join " + table_name(destination, database, schema, 'zendesk__ticket_metrics') + " as ticket "\
+            "on sla.ticket_id = ticket.ticket_id"
+
+def where_clause(destination, model, start_date=None, end_date=None, filter_dictionary=None):
+    # Builds a parameterized where clause. BigQuery uses named parameters, Snowflake and DuckDB use positional (qmark) binds.
+    # Params are returned as (name, type, value) tuples so they stay hashable.
+    conditions = []
+    params = []
+
+    if start_date is not None and end_date is not None:
+        start, end = ("@start_date", "@end_date") if destination == "BigQuery" else ("?", "?")
+        if model == 'ticket':
+            conditions.append("cast(" + date_columns[model] + " as date) between " + start + " and " + end)
+        else:
+            # Like filter_data, SLAs compare the timestamp with the dates: the end date only includes its midnight.
+            conditions.append(date_columns[model] + " between cast(" + start + " as timestamp) and cast(" + end + " as timestamp)")
+        params.append(('start_date', 'DATE', start_date))
+        params.append(('end_date', 'DATE', end_date))
+
+    for k, v in (filter_dictionary or {}).items():
+        # Match filter_data: an empty selection (or one containing None) means no filter.
+        if len(v) == 0 or None in v:
+            continue
+        if destination == "BigQuery":
+            conditions.append(model_columns[model][k] + " in unnest(@" + k + ")")
+            params.append((k, 'STRING', tuple(v)))
+        else:
+            conditions.append(model_columns[model][k] + " in (" + ", ".join("?" * len(v)) + ")")
+            params.extend((k, 'STRING', i) for i in v)
+
+    if len(conditions) == 0:
+        return "", ()
+    return " where " + " and ".join(conditions), tuple(params)
+
+def select_clause(model):
+    return "select " + ", ".join(expression + " as " + column for column, expression in model_columns[model].items()) + " "
+
+def build_query(destination, database, schema, model='ticket', start_date=None, end_date=None, filter_dictionary=None):
+    where, params = where_clause(destination, model, start_date, end_date, filter_dictionary)
+    return select_clause(model) + from_clause(destination, database, schema, model) + where, params
+
+def build_incremental_query(destination, database, schema, model='ticket', watermark=None, active_since=None):
+    query = select_clause(model).rstrip() + ", " + incremental_watermark(model) + " as watermark " + from_clause(destination, database, schema, model)
+    if watermark is None:
+        return query, ()
+
+    # Inclusive bound: rows sharing the watermark are fetched again and deduplicated by merge_rows.
+    placeholder = "@watermark" if destination == "BigQuery" else "?"
+    condition = incremental_watermark(model) + " >= " + placeholder
+    params = [('watermark', 'TIMESTAMP', watermark)]
+    if active_since is not None:
+        # SLAs active at the last sync can since have been breached or completed without a newer
+        # sla_applied_at, so every SLA applied since the oldest of them is fetched again. A time bound
+        # keeps the statement and its binds the same size however many SLAs are open.
+        condition = "(" + condition + " or " + date_columns[model] + " >= " + ("@active_since" if destination == "BigQuery" else "?") + ")"
+        params.append(('active_since', 'TIMESTAMP', active_since))
+    return query + " where " + condition, tuple(params)
+
+def incremental_watermark(model):
+    if model == 'sla':
+        # Joined SLA rows also change when their ticket's dimensions (group, brand, form) are updated.
+        return "greatest(" + watermark_columns[model] + ", coalesce(ticket.updated_at, " + watermark_columns[model] + "))"
+    return watermark_columns[model]
+
+def bigquery_parameter(name, type, value):
+    if isinstance(value, tuple):
+        return bigquery.ArrayQueryParameter(name, type, list(value))
+    return bigquery.ScalarQueryParameter(name, type, value)
+
+def fetch_bigquery(query, params=()):
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery_parameter(*p) for p in params])
+
+    def run(client):
+        query_job = client.query(query, job_config=job_config)
+        # Fetch as an Arrow table, through the BigQuery Storage Read API when it is installed.
+        return query_job.to_arrow(create_bqstorage_client=True)
+
+    return warehouse_pool("BigQuery").run(run)
 
+def run_snowflake_query(query, params=()):
+    def run(session):
+        # to_pandas fetches the result in Arrow batches.
+        return session.sql(query, params=[p[2] for p in params] or None).to_pandas()
+
+    results = warehouse_pool("Snowflake").run(run)
+    # Snowflake returns upper case identifiers, so normalize them to the model column names.
+    results.columns = [c.lower() for c in results.columns]
+    return results
+
+def fetch_duckdb(query, params=()):
+    return warehouse_pool("DuckDB").run(lambda cursor: cursor.execute(query, [p[2] for p in params]).fetch_arrow_table())
+
+def fetch_results(destination, query, params=()):
+    with stage('fetch', destination) as fields:
+        if destination == "BigQuery":
+            results = fetch_bigquery(query, params)
+        elif destination == "DuckDB":
+            results = fetch_duckdb(query, params)
+        else:
+            results = run_snowflake_query(query, params)
+        fields['rows'] = result_rows(results)
+    return results
+
+def result_frame(results, columns, categories=()):
+    # Warehouse results arrive as Arrow tables or DataFrames, local files as DataFrames.
+    if isinstance(results, pa.Table):
+        # Dictionary encode the dimensions in Arrow so pandas builds categoricals without a Python string per row.
+        for column in categories:
+            if column in results.column_names:
+                i = results.schema.get_field_index(column)
+                results = results.set_column(i, column, pc.dictionary_encode(results.column(column)))
+        results = results.to_pandas()
+    return results.reindex(columns=columns)
+
+# Refreshes the persistent parquet cache of a model with the rows changed since its watermark.
+def incremental_results(destination, database, schema, model='ticket'):
+    path = cache_path(destination, database, schema, model)
+    cached = read_cache(path)
+    if cached is None or len(cached) == 0:
+        watermark = None
+    else:
+        watermark = cached['watermark'].max().to_pydatetime()
+
+    active_since = None
+    if model in ('sla', 'sla_fact') and cached is not None:
+        applied = cached.loc[cached['is_active_sla'].eq(True), 'sla_applied_at'].dropna()
+        if len(applied) > 0:
+            active_since = pd.Timestamp(applied.min()).to_pydatetime()
+
+    query_string, params = build_incremental_query(destination, database, schema, model, watermark, active_since)
+    new = result_frame(fetch_results(destination, query_string, params), list(model_columns[model]) + ['watermark'])
+
+    data = merge_rows(cached, new, key_columns[model])
+    if len(new) > 0:
+        write_cache(path, data)
+    return data
+
+def normalize_dtypes(data, model):
+    # Dimensions become categoricals, flags plain bools (missing counts as False) and minute metrics float32.
+    for column in category_columns[model]:
+        data[column] = data[column].astype('category')
+        # Arrow dictionaries keep first seen order, sort them so grouped output is ordered like plain strings.
+        if not data[column].cat.categories.is_monotonic_increasing:
+            data[column] = data[column].cat.reorder_categories(data[column].cat.categories.sort_values())
+    for column in flag_columns[model]:
+        data[column] = data[column].eq(True)
+    for column in minute_columns[model]:
+        data[column] = pd.to_numeric(data[column], errors='coerce', downcast='float')
+    return data
+
+def filter_key(filter_dictionary):
+    # Hashable form of the active filters, matching what where_clause applies.
+    return tuple(sorted((k, tuple(sorted(v, key=str))) for k, v in (filter_dictionary or {}).items() if len(v) > 0 and None not in v))
+
+def dataset_key(destination, database, schema, model='ticket', start_date=None, end_date=None, filter_dictionary=None):
+    return (destination, database, schema, model, start_date, end_date, filter_key(filter_dictionary))
+
+def ticket_dimensions(destination, database, schema):
+    # Ticket dimensions for the local SLA join. The full ticket model is reused when it is already cached,
+    # otherwise only the ticket_id and dimension columns are fetched, once for every SLA query.
+    entry = dataset_cache().lookup(dataset_key(destination, database, schema, 'ticket'))
+    if entry is not None:
+        return entry[2]
+
+    def load():
+        columns = ['ticket_id'] + ticket_dimension_columns
+        query = "select " + ", ".join(ticket_columns[column] + " as " + column for column in columns) + " " + from_clause(destination, database, schema, 'ticket')
+        data = result_frame(fetch_results(destination, query), columns, ticket_dimension_columns)
+        for column in ticket_dimension_columns:
+            data[column] = data[column].astype('category')
+            data[column] = data[column].cat.reorder_categories(data[column].cat.categories.sort_values())
+        return data
+
+    return dataset_cache().get_or_load((destination, database, schema, 'ticket_dimensions'), load)
+
+def join_ticket_dimensions(data, dimensions):
+    # Left join on the integer ticket_id: look up each SLA's ticket row once, then take the dimension codes.
+    # The joined columns share the ticket categoricals, so every dimension string is only held once.
+    ticket_ids = pd.Index(dimensions['ticket_id'])
+    if not ticket_ids.is_unique:
+        dimensions = dimensions.drop_duplicates('ticket_id', keep='last')
+        ticket_ids = pd.Index(dimensions['ticket_id'])
+    positions = ticket_ids.get_indexer(data['ticket_id'])
+    for column in ticket_dimension_columns:
+        source = dimensions[column]
+        codes = np.where(positions >= 0, source.cat.codes.values[positions], -1)
+        data[column] = pd.Categorical.from_codes(codes, dtype=source.dtype)
+    return data
+
+def load_status(message, status=None):
+    # Loading text of a session's load. Background loads (warm-up, refreshes) have no page to write to.
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    if status is None:
+        return st.text(message)
+    return status.text(message)
+
+def load_results(destination, database, schema, model='ticket', start_date=None, end_date=None, filter_dictionary=None):
+    source_model = model
+    if model == 'sla' and sla_local_join and destination in ("BigQuery", "Snowflake", "DuckDB"):
+        # Only the SLA facts are queried. Filters on ticket dimensions cannot be pushed down without the join,
+        # they are applied locally by filter_data.
+        source_model = 'sla_fact'
+        filter_dictionary = {k: v for k, v in (filter_dictionary or {}).items() if k in sla_fact_columns}
+        # The ticket dimensions load alongside the SLA facts.
+        dimensions = submit(ticket_dimensions, destination, database, schema)
+
+    pushdown = start_date is not None or end_date is not None or bool(filter_dictionary)
+
+    if destination in ("BigQuery", "Snowflake") and not pushdown and disk_cache_enabled():
+        query = incremental_results(destination, database, schema, source_model)
+
+    elif destination in ("BigQuery", "Snowflake", "DuckDB"):
+        query_string, params = build_query(destination, database, schema, source_model, start_date, end_date, filter_dictionary)
+        query = fetch_results(destination, query_string, params)
+
+    elif destination == "Dunder Mifflin Sample Data":
+        with stage('fetch', 'sample files') as fields:
+            query = read_model_file(sample_files[model], list(model_columns[model]), file_column_types(model), category_columns[model])
+            fields['rows'] = result_rows(query)
+
+    # Convert the results to the typed model frame.
+    with stage('convert', model) as fields:
+        if model == 'ticket':
+            data = result_frame(query, list(ticket_columns), category_columns[model])
+            # Get the data into the app and specify any datatypes if needed.
+            data_load_state = load_status('Loading data...')
+            data['created_at'] = pd.to_datetime(data['created_at']).dt.tz_localize(None).dt.normalize()
+            data['created_timestamp'] = pd.to_datetime(data['created_timestamp']).dt.tz_localize(None)
+            data['first_solved_at'] = pd.to_datetime(data['first_solved_at']).dt.tz_localize(None).dt.normalize()
+            data = derive_columns(normalize_dtypes(data, model), model)
+            load_status("Done! (using the dataset cache)", data_load_state)
+
+        elif model == 'sla':
+            data = result_frame(query, list(sla_columns), category_columns[model])
+            if source_model == 'sla_fact':
+                data = join_ticket_dimensions(data, dimensions.result())
+
+            # Get the data into the app and specify any datatypes if needed.
+            data_load_state = load_status('Loading data...')
+            data['sla_applied_at'] = pd.to_datetime(data['sla_applied_at'])
+            data['sla_breach_at'] = pd.to_datetime(data['sla_breach_at'])
+            data['sla_breach_at'] = data['sla_breach_at'].dt.tz_localize(None)
+            data['sla_applied_at'] = data['sla_applied_at'].dt.tz_localize(None)
+            data['created_at'] = data['sla_applied_at'].dt.normalize()
+            data = derive_columns(normalize_dtypes(data, model), model)
+            load_status("Done! (using the dataset cache)", data_load_state)
+
+        # Rows are kept sorted by day, so a date range is a slice of the filter day index.
+        day_column = 'created_at' if model == 'ticket' else 'sla_applied_at'
+        if not data[day_column].is_monotonic_increasing:
+            data = data.sort_values(day_column, kind='stable', na_position='last', ignore_index=True)
+        fields['rows'] = len(data)
+
+    return data
+
+def derive_columns(data, model):
+    # Calendar parts used by the page charts, derived once per load so the pages never copy or re-parse dates.
+    if model == 'ticket':
+        data['created_hour'] = data['created_timestamp'].dt.hour
+        data['created_weekday'] = pd.Categorical(data['created_at'].dt.day_name(), categories=weekday_order, ordered=True)
+        data['created_year'] = data['created_at'].dt.year
+        data['created_month'] = data['created_at'].dt.month
     elif model == 'sla':
-        data = pd.DataFrame(query, columns=['sla_event_id','ticket_id','sla_policy_name','metric','sla_applied_at','target','in_business_hours','sla_breach_at','sla_elapsed_time','is_active_sla','is_sla_breach','ticket_group','ticket_brand','ticket_form','requester_organization','ticket_channel'])
-
-        # Get the data into the app and specify any datatypes if needed.
-        data_load_state = st.text('Loading data...')
-        data['sla_applied_at'] = pd.to_datetime(data['sla_applied_at'])
-        data['sla_breach_at'] = pd.to_datetime(data['sla_breach_at'])
-        data['sla_breach_at'] = data['sla_breach_at'].dt.tz_localize(None)
-        data['sla_applied_at'] = data['sla_applied_at'].dt.tz_localize(None)
-        data['created_at'] = data['sla_applied_at'].dt.date
-        data_load_state.text("Done! (using st.cache_data)")
-
-    return data
\ No newline at end of file
+        data['breach_hour'] = data['sla_breach_at'].dt.hour
+        data['breach_weekday'] = data['sla_breach_at'].dt.dayofweek
+        data['breach_date'] = data['sla_breach_at'].dt.normalize()
+    return data
+
+def query_results(destination, database, schema, model='ticket', start_date=None, end_date=None, filter_dictionary=None):
+    # When start_date/end_date or filter_dictionary are given (pushdown mode) they are applied in the warehouse
+    # so only matching rows are transferred. The sample data ignores them and is filtered locally by filter_data.
+    # Every source goes through the shared dataset cache, the returned DataFrame is shared and must not be modified.
+    if destination == "Dunder Mifflin Sample Data":
+        start_date, end_date, filter_dictionary = None, None, None
+    key = dataset_key(destination, database, schema, model, start_date, end_date, filter_dictionary)
+    return dataset_cache().get_or_load(key, lambda: load_results(destination, database, schema, model, start_date, end_date, filter_dictionary))
+
+def load_models(destination, database, schema, models=('ticket', 'sla'), start_date=None, end_date=None, filter_dictionary=None):
+    # Starts query_results for every model at once on the fetch pool and returns their futures by model, so
+    # loading several models takes about as long as the slowest one.
+    return {model: submit(query_results, destination, database, schema, model, start_date, end_date, filter_dictionary) for model in models}
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from functions.filters import filter_index, filter_positions, column_codes, column_days, day_number, missing_day, store_index
+from functions.cube import cube_dimensions
+from functions.buckets import bucket_dates
+from functions.profiling import stage
+
+# Mergeable quantile sketches (DDSketch style log buckets) of the minute metrics, one per day, or per day and
+# value of one dimension. A bucket's counts can simply be added, so the quantiles of any date range, or
+# selection on that dimension, or of each of its values, are found by summing the selected days' buckets.
+# Every non zero value is represented within sketch_accuracy relative error.
+sketch_accuracy = 0.01
+gamma = (1 + sketch_accuracy) / (1 - sketch_accuracy)
+# Positive values are bucketed between min_value and max_value (smaller values share the first bucket,
+# larger the last). Bucket 0 holds zero and negative values.
+min_value = 1e-3
+max_value = 1e9
+min_key = int(np.ceil(np.log(min_value) / np.log(gamma)))
+bucket_count = int(np.ceil(np.log(max_value) / np.log(gamma))) - min_key + 2
+# Dimensions sketched by day, like the cubes, plus the assignees of the leaderboard. Quantiles over other
+# selections are computed from the filtered rows.
+sketch_dimensions = {
+    'ticket': cube_dimensions['ticket'] + ['assignee_name'],
+    'sla': cube_dimensions['sla']
+}
+
+def value_buckets(values):
+    buckets = np.zeros(len(values), dtype=np.int64)
+    positive = values > 0
+    keys = np.ceil(np.log(values[positive]) / np.log(gamma)).astype(np.int64)
+    buckets[positive] = np.clip(keys - min_key + 1, 1, bucket_count - 1)
+    return buckets
+
+def bucket_values():
+    # Value reported for each bucket: the middle of its range, relative to the range bounds.
+    keys = np.arange(bucket_count) - 1 + min_key
+    values = 2 * gamma ** keys.astype(np.float64) / (gamma + 1)
+    values[0] = 0
+    return values
+
+def column_sketch(data_ref, column, model='ticket', dimension=None):
+    # The sketches of one column by day, or by day and dimension code, stored sparse as (day, code * bucket_count
+    # + bucket, count) arrays sorted by day. Rows without a day, or dimension value, are left out. Built once per
+    # loaded dataset, alongside its filter indexes.
+    index = filter_index(data_ref)
+    if ('sketch', model, column, dimension) not in index:
+        days = column_days(data_ref, 'created_at' if model == 'ticket' else 'sla_applied_at').astype(np.int64)
+        values = data_ref[column].values.astype(np.float64)
+        valid = ~np.isnan(values) & (days != missing_day)
+        if dimension is None:
+            codes, code_count = np.zeros(len(values), dtype=np.int64), 1
+        else:
+            codes, categories = column_codes(data_ref, dimension)
+            codes, code_count = codes.astype(np.int64), len(categories)
+            valid &= codes >= 0
+        first = int(days[valid].min()) if valid.any() else 0
+        cells = (days[valid] - first) * code_count + codes[valid]
+        keys, counts = np.unique(cells * bucket_count + value_buckets(values[valid]), return_counts=True)
+        cells = keys // bucket_count
+        store_index(data_ref, ('sketch', model, column, dimension), (first + cells // code_count, cells % code_count * bucket_count + keys % bucket_count, counts.astype(np.float64)))
+    return index[('sketch', model, column, dimension)]
+
+def merged_sketches(keys, counts, group_count):
+    # Adds up the counts of equal group code * bucket_count + bucket keys. Returns them as (group, bucket, count)
+    # arrays sorted by group and bucket.
+    if len(keys) * 16 < group_count * bucket_count:
+        # Few entries, sorting them is cheaper than counting every possible bucket.
+        keys, inverse = np.unique(keys, return_inverse=True)
+        merged = np.bincount(inverse, weights=counts, minlength=len(keys))
+    else:
+        merged = np.bincount(keys, weights=counts, minlength=group_count * bucket_count)
+        keys = np.flatnonzero(merged > 0)
+        merged = merged[keys]
+    return keys // bucket_count, keys % bucket_count, merged
+
+def sketch_quantiles(groups, buckets, counts, group_count, q):
+    # Quantile q of every group from merged entries, interpolated between the two middle ranks like pandas.
+    # Groups without values give NaN.
+    if len(counts) == 0:
+        return np.full(group_count, np.nan)
+    totals = np.bincount(groups, weights=counts, minlength=group_count)
+    cumulative = np.cumsum(counts)
+    before = np.cumsum(totals) - totals
+    rank = q * np.maximum(totals - 1, 0)
+    # The bucket of a rank is the first whose count from the start of its group goes past it.
+    values = bucket_values()[buckets]
+    lower = values[np.minimum(np.searchsorted(cumulative, before + np.floor(rank), side='right'), len(counts) - 1)]
+    upper = values[np.minimum(np.searchsorted(cumulative, before + np.ceil(rank), side='right'), len(counts) - 1)]
+    fraction = rank - np.floor(rank)
+    return np.where(totals > 0, lower + (upper - lower) * fraction, np.nan)
+
+def approximate_quantile(start, end, data_ref, filter_dictionary, column, q=0.5, by=None, model='ticket', granularity='day'):
+    # Quantile q of column over the date range and filters, from the merged sketches. With by (the day column
+    # or a dimension) a Series with one quantile per group is returned instead of a scalar. The day column
+    # can be grouped by week or month buckets with granularity.
+    day_column = 'created_at' if model == 'ticket' else 'sla_applied_at'
+    active = [k for k, v in filter_dictionary.items() if len(v) > 0 and None not in v]
+    keys = list(dict.fromkeys(([] if by in (None, day_column) else [by]) + active))
+    sketched = len(keys) <= 1 and all(key in sketch_dimensions[model] for key in keys)
+    with stage('aggregate', ('sketch ' if sketched else 'rows quantile ') + column + ('' if by is None else ' by ' + by)):
+        if sketched:
+            return merged_quantile(start, end, data_ref, filter_dictionary, column, q, by, model, granularity, keys[0] if keys else None)
+        return rows_quantile(start, end, data_ref, filter_dictionary, column, q, by, model, granularity)
+
+def merged_quantile(start, end, data_ref, filter_dictionary, column, q, by, model, granularity, dimension):
+    days, keys, counts = column_sketch(data_ref, column, model, dimension)
+    # Days are sorted, the date range is a slice.
+    first, last = np.searchsorted(days, [day_number(start), day_number(end) + (1 if model == 'ticket' else 0)])
+    days, keys, counts = days[first:last], keys[first:last], counts[first:last]
+    if model != 'ticket':
+        # Like filter_positions, the end date only counts the SLAs applied exactly at its midnight, added from
+        # the rows.
+        positions = filter_positions(end, end, data_ref, {}, model)
+        values = data_ref[column].values[positions].astype(np.float64)
+        codes = np.zeros(len(values), dtype=np.int64) if dimension is None else column_codes(data_ref, dimension)[0][positions].astype(np.int64)
+        valid = ~np.isnan(values) & (codes >= 0)
+        days = np.concatenate([days, np.full(valid.sum(), day_number(end))])
+        keys = np.concatenate([keys, codes[valid] * bucket_count + value_buckets(values[valid])])
+        counts = np.concatenate([counts, np.ones(valid.sum())])
+    if dimension is not None and len(filter_dictionary.get(dimension, [])) > 0:
+        categories = column_codes(data_ref, dimension)[1]
+        allowed = np.zeros(len(categories), dtype=bool)
+        selected = categories.get_indexer(list(filter_dictionary[dimension]))
+        allowed[selected[selected >= 0]] = True
+        mask = allowed[keys // bucket_count]
+        days, keys, counts = days[mask], keys[mask], counts[mask]
+
+    if by is None:
+        return sketch_quantiles(*merged_sketches(keys % bucket_count, counts, 1), 1, q)[0]
+
+    if by == dimension:
+        groups = column_codes(data_ref, dimension)[1]
+        if isinstance(data_ref[by].dtype, pd.CategoricalDtype):
+            # Categorical like the index of a groupby of the rows.
+            groups = pd.Categorical.from_codes(np.arange(len(groups)), dtype=data_ref[by].dtype)
+    else:
+        day_values, codes = np.unique(days, return_inverse=True)
+        dates = pd.Series(day_values.astype('datetime64[D]')).astype(data_ref[by].dtype)
+        groups = dates.values
+        if granularity != 'day':
+            bucket_codes, groups = pd.factorize(bucket_dates(dates, granularity), sort=True)
+            codes = bucket_codes[codes]
+        keys = codes.astype(np.int64) * bucket_count + keys % bucket_count
+    groups = pd.Index(groups, name=by)
+    quantiles = pd.Series(sketch_quantiles(*merged_sketches(keys, counts, len(groups)), len(groups), q), index=groups, name=column)
+    return quantiles.dropna()
+
+def rows_quantile(start, end, data_ref, filter_dictionary, column, q, by, model, granularity):
+    # Same results from the filtered rows, for selections without a sketch.
+    rows = data_ref.iloc[filter_positions(start, end, data_ref, filter_dictionary, model)]
+    values = rows[column].astype('float64')
+    if by is None:
+        return values.quantile(q)
+    groups = rows[by]
+    if by == ('created_at' if model == 'ticket' else 'sla_applied_at'):
+        groups = bucket_dates(groups.dt.normalize(), granularity)
+    return values.groupby(groups, observed=True).quantile(q).rename_axis(by).rename(column).dropna()
@@ -0,0 +1,48 @@
+import os
+import hmac
+import pandas as pd
+import streamlit as st
+from functions.cache import dataset_cache, cache_max_bytes
+
+# Operator view of the tenants (destination, database and schema) with datasets in the shared cache, shown on
+# the overview page with ?admin=<ZENDESK_ADMIN_TOKEN>. Off unless the token is set, tenant names are not shown
+# to other users.
+admin_token = os.environ.get('ZENDESK_ADMIN_TOKEN', '')
+
+def admin_enabled():
+    # Compared as bytes, compare_digest only takes ASCII strings.
+    return admin_token != '' and hmac.compare_digest(st.query_params.get('admin', '').encode(), admin_token.encode())
+
+def tenant_admin():
+    if not admin_enabled():
+        return
+    cache = dataset_cache()
+    usage = pd.DataFrame(cache.tenant_usage(), columns=['tenant', 'last_used', 'entries', 'bytes', 'index_bytes', 'spilled_entries', 'spilled_bytes'])
+    usage = usage.sort_values('last_used', ascending=False, na_position='last', ignore_index=True)
+
+    st.header('Resident tenants')
+    resident = usage['bytes'].sum()
+    shared = sum(shared_cache.total_bytes for shared_cache in cache.shared)
+    st.caption(f'{(resident + shared) / 1024 ** 2:.1f} MiB used of the {cache_max_bytes / 1024 ** 2:.0f} MiB budget: {resident / 1024 ** 2:.1f} MiB of datasets, '
+               f'including {usage["index_bytes"].sum() / 1024 ** 2:.1f} MiB of indexes, and {shared / 1024 ** 2:.1f} MiB of shared page results. '
+               'Over budget, the least recently used tenants are evicted first.')
+    table = pd.DataFrame({
+        'destination': [tenant[0] for tenant in usage['tenant']],
+        'database': [tenant[1] for tenant in usage['tenant']],
+        'schema': [tenant[2] for tenant in usage['tenant']],
+        'last used': pd.to_datetime(usage['last_used'], unit='s').dt.floor('s'),
+        'datasets': usage['entries'],
+        'MiB': (usage['bytes'] / 1024 ** 2).round(1),
+        'index MiB': (usage['index_bytes'] / 1024 ** 2).round(1),
+        'spilled datasets': usage['spilled_entries'],
+        'spilled MiB': (usage['spilled_bytes'] / 1024 ** 2).round(1)
+    })
+    st.dataframe(table, hide_index=True, use_container_width=True)
+
+    resident_tenants = [tenant for tenant, entries in zip(usage['tenant'], usage['entries']) if entries > 0]
+    if len(resident_tenants) > 0:
+        tenant = st.selectbox('Tenant', resident_tenants, format_func=lambda tenant: ' / '.join(str(part) for part in tenant))
+        if st.button('Evict tenant'):
+            cache.evict_tenant(tenant)
+            st.rerun()
+    st.markdown('---')
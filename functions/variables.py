@@ -1,7 +1,8 @@
+import os
 import streamlit as st
 
 def destination_selection():
-    destination_options = ['Dunder Mifflin Sample Data', 'BigQuery', 'Snowflake']
+    destination_options = ['Dunder Mifflin Sample Data', 'BigQuery', 'Snowflake', 'DuckDB']
     default_index = destination_options.index('Dunder Mifflin Sample Data')
     if st.session_state.get("destination", "Dunder Mifflin Sample Data") == "Dunder Mifflin Sample Data":
         destination = st.sidebar.selectbox('Choose your destination:', destination_options, index=default_index)
@@ -12,7 +13,14 @@ def destination_selection():
     return destination
 
 def database_schema_variables():
-    if st.session_state.get("destination", "Dunder Mifflin Sample Data") != "Dunder Mifflin Sample Data":
+    if st.session_state.get("destination", "Dunder Mifflin Sample Data") == "DuckDB":
+        # DuckDB reads the Parquet snapshots of a local directory, so the "database" is that directory.
+        default_directory = st.session_state.get("database") or os.environ.get("ZENDESK_DUCKDB_DIR", "Directory")
+        database = st.sidebar.text_input("Enter the directory of your Parquet snapshots:", default_directory)
+        schema = None
+        st.session_state.database = database
+        st.session_state.schema = schema
+    elif st.session_state.get("destination", "Dunder Mifflin Sample Data") != "Dunder Mifflin Sample Data":
         if st.session_state.get("database", "Database") == "Database":
             database = st.sidebar.text_input("Enter the name of your database:", "Database")
         else:
@@ -34,3 +42,47 @@ def database_schema_variables():
         st.session_state.schema = schema
 
     return database, schema
+
+def connection_warning(destination, database, schema):
+    # Message shown instead of the dashboards while the selected destination is not fully configured.
+    if destination in ("BigQuery", "Snowflake") and (database in ("Database", "None") or schema in ("Schema", "None")):
+        return 'To leverage your own internal data, you will need to fork this repo and deploy as your own Streamlit app. Please see the README for additional details.'
+    if destination == "DuckDB" and not os.path.isdir(str(database)):
+        return 'Enter a directory containing zendesk__ticket_metrics and zendesk__sla_policies Parquet snapshots. Please see the README for additional details.'
+    return None
+
+def pushdown_selection():
+    # Pushdown mode applies the date range and optional filters in the warehouse instead of in pandas.
+    if st.session_state.get("destination", "Dunder Mifflin Sample Data") in ("BigQuery", "Snowflake", "DuckDB"):
+        pushdown = st.sidebar.checkbox("Push filters down to the warehouse", value=st.session_state.get("pushdown", False))
+    else:
+        pushdown = False
+    st.session_state.pushdown = pushdown
+    return pushdown
+
+def aggregation_selection():
+    # Aggregate mode computes every chart with a GROUP BY in the warehouse, the rows are never downloaded.
+    if st.session_state.get("destination", "Dunder Mifflin Sample Data") in ("BigQuery", "Snowflake", "DuckDB"):
+        aggregate = st.sidebar.checkbox("Aggregate in the warehouse", value=st.session_state.get("aggregate", False))
+    else:
+        aggregate = False
+    st.session_state.aggregate = aggregate
+    return aggregate
+
+def approximation_selection():
+    # Approximate medians come from quantile sketches merged per date range and filter, instead of sorting the rows.
+    # In aggregate mode the warehouse computes the medians.
+    if st.session_state.get("aggregate", False):
+        approximate = False
+    else:
+        approximate = st.sidebar.checkbox("Approximate medians (within 1%)", value=st.session_state.get("approximate", False))
+    st.session_state.approximate = approximate
+    return approximate
+
+def granularity_selection():
+    # Date charts pick day, week or month buckets from the date range, unless one is chosen here.
+    options = ['Auto', 'Day', 'Week', 'Month']
+    selected = st.session_state.get("granularity", "auto").capitalize()
+    granularity = st.sidebar.selectbox("Date chart granularity:", options, index=options.index(selected), help="Long date ranges are still grouped by a coarser granularity to keep the charts readable.")
+    st.session_state.granularity = granularity.lower()
+    return granularity.lower()
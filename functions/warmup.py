@@ -0,0 +1,35 @@
+import logging
+import threading
+from functions.query import load_models
+from functions.workers import submit, gather
+from functions.metadata import dataset_metadata
+
+logger = logging.getLogger(__name__)
+
+# Connections this process has started warming up.
+warmed = set()
+warm_lock = threading.Lock()
+
+def warm_up(destination, database, schema, load_rows=True):
+    # Loads the ticket and SLA models and their metadata into the dataset cache in the background, so the first
+    # visit to a report finds them cached. Without load_rows (pushdown and aggregate modes) only the metadata
+    # is loaded. Runs once per connection and process, a page asking for a model while it is loading waits
+    # for the same load instead of starting another.
+    key = (destination, database, schema, load_rows)
+    with warm_lock:
+        if key in warmed:
+            return False
+        warmed.add(key)
+
+    def run():
+        try:
+            if load_rows:
+                # Both models are fetched at the same time.
+                gather(load_models(destination, database, schema))
+            # Derived from the rows just loaded when there are any.
+            gather({model: submit(dataset_metadata, destination, database, schema, model) for model in ('ticket', 'sla')})
+        except Exception:
+            logger.exception('Warm-up of %s failed', destination)
+
+    threading.Thread(target=run, name='dataset-warm-up', daemon=True).start()
+    return True
@@ -0,0 +1,30 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import streamlit as st
+
+# Bounded thread pool running independent warehouse loads at the same time, shared by every session.
+# The loads go through the dataset cache as usual, so a page asking for a dataset that is still loading
+# waits for that load instead of starting another.
+fetch_workers = int(os.environ.get('ZENDESK_FETCH_WORKERS', 4))
+worker_prefix = 'dataset-fetch'
+
+@st.cache_resource(show_spinner=False)
+def fetch_pool():
+    return ThreadPoolExecutor(fetch_workers, thread_name_prefix=worker_prefix)
+
+def submit(fn, *args, **kwargs):
+    # Returns a Future of fn(*args, **kwargs). Loads started from a pool worker run inline, so nested loads
+    # cannot fill the pool with workers waiting on each other.
+    if threading.current_thread().name.startswith(worker_prefix):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return fetch_pool().submit(fn, *args, **kwargs)
+
+def gather(futures):
+    # Waits for a dict of futures and returns their results under the same keys.
+    return {name: future.result() for name, future in futures.items()}
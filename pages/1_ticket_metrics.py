@@ -3,8 +3,13 @@ import plost
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from functions.filters import date_filter, optional_filters, filter_data
-from functions.variables import database_schema_variables, destination_selection
+from functions.filters import date_filter, dataset_rows, optional_filters, filter_data
+from functions.cube import filter_cube
+from functions.aggregates import warehouse_cube, hourly_counts, weekday_counts, attribute_counts, date_attribute_counts, month_counts
+from functions.memo import page_result
+from functions.buckets import chart_granularity, bucket_dates, bucket_labels, bucket_caption
+from functions.profiling import start_profiling, page_section, profile_panel
+from functions.variables import database_schema_variables, destination_selection, pushdown_selection, aggregation_selection, granularity_selection, connection_warning
 
 ## Apply standard page settings.
 st.set_page_config(
@@ -12,6 +17,9 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+## Time the page stages when profiling is switched on
+start_profiling('1_ticket_metrics')
+
 # Hide sidebar with custom query param (used for embeding the app in Fivetran)
 hide_sidebar = st.query_params.get('hide_sidebar', 'false').lower() == 'true'
 if hide_sidebar:
@@ -26,60 +34,160 @@ if hide_sidebar:
         unsafe_allow_html=True
     )
 
+## Charts with their own widgets run as fragments: changing the drill down attribute or the years
+## only reruns that chart, on the dataset already filtered by the full page run.
+## The chart results computed from the rows are shared with the other sessions showing the same view.
+@st.fragment
+def attribute_charts(start_date, end_date, filter_dict, data, data_date_filtered, aggregate, granularity):
+    #####################################################################################################
+    # Ticket by selected attributes
+    page_section('Tickets by selected attribute (top 10)')
+    option = st.selectbox(
+        'Please select an attribute to drill down',
+        ('ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group', 'ticket_priority', 'ticket_type')
+    )
+
+    st.write('You selected:', option)
+
+    st.subheader('Tickets by selected attribute (top 10)')
+    # Count the number of occurrences of each unique brand name
+    if aggregate:
+        option_counts = attribute_counts(start_date, end_date, filter_dict, option)
+    else:
+        option_counts = page_result('tickets by attribute', data, start_date, end_date, filter_dict, lambda: data_date_filtered[option].value_counts(), params=(option,))
+    option_counts = option_counts[option_counts > 0]
+
+    # Keep only the top 10 brands
+    top_attributes = option_counts.nlargest(10)
+
+    # Convert the counts to percentages
+    top_attributes_percentages = top_attributes / top_attributes.sum() * 100
+
+    # Plot the percentages using Streamlit
+    st.bar_chart(top_attributes_percentages)
+    #####################################################################################################
+
+    #####################################################################################################
+    ## Tickets created by date and selected attribute
+    page_section('Tickets created by date and selected attribute (top 10)')
+    st.subheader('Tickets created by date and selected attribute (top 10)')
+    bucket_caption(granularity)
+    if aggregate:
+        df_counts = date_attribute_counts(start_date, end_date, filter_dict, option, granularity=granularity)
+    else:
+        df_counts = page_result('tickets by date and attribute', data, start_date, end_date, filter_dict,
+                                lambda: data_date_filtered.groupby([bucket_dates(data_date_filtered['created_at'], granularity), option], observed=True).size().reset_index(name='Number of Tickets'),
+                                params=(option, granularity))
+    df_counts = df_counts.assign(created_at=bucket_labels(df_counts['created_at'], granularity, '%Y-%m-%d'))
+
+    pivot_df = df_counts.pivot(index='created_at', columns=option, values='Number of Tickets')
+
+    # Display the plot in Streamlit
+    st.bar_chart(pivot_df)
+    #####################################################################################################
+
+@st.fragment
+def month_chart(data, aggregate, pushdown):
+    #####################################################################################################
+    # Charts for tickets created per year by month
+    page_section('Tickets created by month/year')
+    st.subheader('Tickets created by month/year')
+    # Group by year and month of the creation date and count the number of tickets
+    if aggregate or pushdown:
+        # Pushed down rows only cover the date range and filters, the chart shows the whole history.
+        month_totals = month_counts()
+    else:
+        month_data = data[['created_year', 'created_month']].rename(columns={'created_year': 'year', 'created_month': 'month'})
+        month_totals = page_result('tickets by month', data, None, None, {}, lambda: month_data.groupby(['year', 'month']).size().reset_index(name='Number of Tickets'))
+
+    # Get the list of unique years
+    years = sorted(month_totals['year'].unique())
+
+    # Sidebar multiselect for years
+    selected_years = st.multiselect('Select years', years, default=years)
+
+    # Filter data for selected years
+    df_counts = month_totals[month_totals['year'].isin(selected_years)]
+
+    # Pivot the data for the plot
+    df_pivot = df_counts.pivot(index='month', columns='year', values='Number of Tickets')
+
+    # Display the plot in Streamlit
+    st.bar_chart(df_pivot)
+    #####################################################################################################
+
 st.sidebar.header('Data Connection Variables')
 destination = destination_selection()
 database, schema = database_schema_variables()
+pushdown = pushdown_selection()
+aggregate = aggregation_selection()
+selected_granularity = granularity_selection()
 
 st.title('Zendesk Ticket Metrics')
 
-if destination in ("BigQuery","Snowflake") and (database in ("Database", "None") or schema in ("Schema", "None")):
-    st.warning('To leverage your own internal data, you will need to fork this repo and deploy as your own Streamlit app. Please see the README for additional details.')
+warning = connection_warning(destination, database, schema)
+if warning is not None:
+    st.warning(warning)
 else:
     ## Define the top level date filter
-    data, d = date_filter(dest=destination, db=database, sc=schema)
+    page_section('Filters')
+    d = date_filter(dest=destination, db=database, sc=schema)
 
     ## Include the optional filters as well
-    filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations = optional_filters(data_ref=data, include_assignee=False)
+    filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations = optional_filters(include_assignee=False)
 
     ## End filter section
     st.markdown('---')
 
+    ## Load the rows once the filter bar is drawn
+    page_section('Rows')
+    data = dataset_rows(dest=destination, db=database, sc=schema, filter_dictionary=filter_dict)
+
     ## Only generate the tiles if date range is populated
     if d is not None and len(d) == 2:
         start_date, end_date = d
         if start_date is not None:
+            ## Day, week or month buckets for the date charts
+            granularity = chart_granularity(start_date, end_date, selected_granularity)
 
             ## Filter data based on filters applied
-            data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
+            page_section('Filter')
+            if aggregate:
+                daily_cube = warehouse_cube(start=start_date, end=end_date, filter_dictionary=filter_dict)
+                data_date_filtered = None
+            else:
+                data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
+                daily_cube = filter_cube(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
 
             #####################################################################################################
             ## KPIs and Metrics
+            page_section('KPIs')
             col1, col2, col3 = st.columns(3)
             with col1:
                 st.subheader('Created tickets')
-                ticket_created_count = len(data_date_filtered)
+                ticket_created_count = int(daily_cube['created_tickets'].sum())
                 st.metric("Count of created tickets", ticket_created_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col2:
                 st.subheader('Unsolved tickets')
-                ticket_unsolved_count = len(data_date_filtered.query("`status` != 'solved'"))
+                ticket_unsolved_count = int(daily_cube['created_tickets'].sum() - daily_cube['solved_tickets'].sum())
                 st.metric("Count of unsolved tickets", ticket_unsolved_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col3:
                 st.subheader('Solved tickets')
-                ticket_unsolved_count = len(data_date_filtered.query("`status` == 'solved'"))
+                ticket_unsolved_count = int(daily_cube['solved_tickets'].sum())
                 st.metric("Count of solved tickets", ticket_unsolved_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
             #####################################################################################################
 
             #####################################################################################################
             ## Bar chart: Tickets created by hour
+            page_section('Tickets created by hour')
             st.subheader('Tickets created by hour')
-            ticket_by_hour_data = data_date_filtered.copy()
-
-            ticket_by_hour_data['created_timestamp'] = pd.to_datetime(ticket_by_hour_data['created_timestamp'])
-            ticket_by_hour_data['hour'] = ticket_by_hour_data['created_timestamp'].dt.hour
             # Count the number of tickets created each hour
-            hourly_tickets = ticket_by_hour_data.groupby('hour')['ticket_id'].count()
+            if aggregate:
+                hourly_tickets = hourly_counts(start_date, end_date, filter_dict)
+            else:
+                hourly_tickets = page_result('tickets by hour', data, start_date, end_date, filter_dict, lambda: data_date_filtered.groupby('created_hour')['ticket_id'].count().rename_axis('hour'))
             # Calculate the percentage
             total_tickets = hourly_tickets.sum()
             hourly_percentage = ((hourly_tickets / total_tickets) * 100).round(2)
@@ -89,22 +197,19 @@ else:
 
             #####################################################################################################
             ## Bar chart: Average tickets created by day of week
+            page_section('Average tickets created by day of week')
             st.subheader('Average tickets created by day of week')
-            avg_ticket_by_day_week = data_date_filtered.copy()
-
-            # Convert 'created_at' to datetime and extract day of week if it's not already in that format
-            avg_ticket_by_day_week['created_at'] = pd.to_datetime(avg_ticket_by_day_week['created_at'])
-            avg_ticket_by_day_week['day_of_week'] = avg_ticket_by_day_week['created_at'].dt.day_name()
 
-            # Define the correct order for days of the week
-            correct_order = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
-            avg_ticket_by_day_week['day_of_week'] = pd.Categorical(avg_ticket_by_day_week['day_of_week'], categories=correct_order, ordered=True)
-
-            # Group by day of week and count tickets
-            daily_tickets = avg_ticket_by_day_week.groupby('day_of_week')['ticket_id'].count()
+            # Group by day of week (ordered Sunday to Saturday) and count tickets
+            if aggregate:
+                daily_tickets = weekday_counts(start_date, end_date, filter_dict)
+                # The daily cube only has days with tickets.
+                total_days = daily_cube['created_at'].nunique()
+            else:
+                daily_tickets = page_result('tickets by weekday', data, start_date, end_date, filter_dict, lambda: data_date_filtered.groupby('created_weekday', observed=False)['ticket_id'].count().rename_axis('day_of_week'))
+                total_days = page_result('ticket days', data, start_date, end_date, filter_dict, lambda: len(data_date_filtered['created_at'].unique()))
 
             # Calculate the average
-            total_days = len(avg_ticket_by_day_week['created_at'].dt.normalize().unique())
             average_daily_tickets = (daily_tickets / total_days).round(2)
 
             # Plot the time series using Streamlit
@@ -113,28 +218,19 @@ else:
 
             #####################################################################################################
             ## Bar chart for tickets created and solved by date
+            page_section('Tickets created by date')
             st.subheader('Tickets created by date')
-            tickets_solve_date = data_date_filtered.copy()
-
-            # Convert 'created_at' and 'first_solved_at' to datetime, make them timezone naive, and extract date
-            tickets_solve_date['created_at'] = pd.to_datetime(tickets_solve_date['created_at']).dt.tz_localize(None).dt.date
-            tickets_solve_date['first_solved_at'] = pd.to_datetime(tickets_solve_date['first_solved_at']).dt.tz_localize(None).dt.date
-
-            # Group by date and count the number of tickets created each day
-            created_tickets = tickets_solve_date.groupby('created_at').size()
+            bucket_caption(granularity)
 
-            # Filter rows where 'first_solved_at' is not null, and group by 'created_at' to count
-            solved_tickets = tickets_solve_date[tickets_solve_date['first_solved_at'].notna()].groupby('created_at').size()
-
-            # Combine the data into one DataFrame and fill NaN values with 0
-            df_counts = pd.concat([created_tickets, solved_tickets], axis=1)
-            df_counts.columns = ['Created Tickets', 'Solved Tickets']
-            df_counts = df_counts.fillna(0)
+            # Sum the daily cube cells: tickets created each day (or week or month), and those of them with a 'first_solved_at'
+            df_counts = page_result('tickets by date', data, start_date, end_date, filter_dict,
+                                    lambda: daily_cube.groupby(bucket_dates(daily_cube['created_at'], granularity))[['created_tickets', 'first_solved_tickets']].sum(),
+                                    params=(granularity,))
+            df_counts = df_counts.set_axis(['Created Tickets', 'Solved Tickets'], axis=1)
             # Reset the index to make 'date' a column in the DataFrame
-            df_counts.reset_index(inplace=True)
-            df_counts.rename(columns={'index':'Date'}, inplace=True)
-            # Convert the dates to string in 'YYYY-MM-DD' format
-            df_counts['created_at'] = df_counts['created_at'].apply(lambda x: x.strftime('%m-%d'))
+            df_counts = df_counts.reset_index()
+            # Convert the dates to string in 'MM-DD' format
+            df_counts['created_at'] = bucket_labels(df_counts['created_at'], granularity, '%m-%d')
 
             # Plot the time series using Streamlit
             # pt.bar_chart(df_counts)
@@ -147,72 +243,13 @@ else:
             )
             #####################################################################################################
 
-            #####################################################################################################
-            # Ticket by selected attributes
-            option = st.selectbox(
-                'Please select an attribute to drill down',
-                ('ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group', 'ticket_priority', 'ticket_type')
-            )
-
-            att_data = data_date_filtered.copy()
-            st.write('You selected:', option)
-
-            st.subheader('Tickets by selected attribute (top 10)')
-            # Count the number of occurrences of each unique brand name
-            attribute_counts = att_data[option].value_counts()
-
-            # Keep only the top 10 brands
-            top_attributes = attribute_counts.nlargest(10)
-
-            # Convert the counts to percentages
-            top_attributes_percentages = top_attributes / top_attributes.sum() * 100
-
-            # Plot the percentages using Streamlit
-            st.bar_chart(top_attributes_percentages)
-            #####################################################################################################
-
-            #####################################################################################################
-            ## Tickets created by date and selected attribute
-            st.subheader('Tickets created by date and selected attribute (top 10)')
-            att_data['created_at'] = pd.to_datetime(att_data['created_at']).dt.tz_localize(None).dt.date.astype(str)
-
-            df_counts = att_data.groupby(['created_at', option]).size().reset_index(name='Number of Tickets')
-
-            pivot_df = df_counts.pivot(index='created_at', columns=option, values='Number of Tickets')
-
-            # Display the plot in Streamlit
-            st.bar_chart(pivot_df)
-            #####################################################################################################
+            attribute_charts(start_date, end_date, filter_dict, data, data_date_filtered, aggregate, granularity)
 
             st.markdown('---')
 
-            #####################################################################################################
-            # Charts for tickets created per year by month
-            st.subheader('Tickets created by month/year')
-            # Extract year and month from the date
-            data['created_at'] = pd.to_datetime(data['created_at'])
-            data['year'] = data['created_at'].dt.year
-            data['month'] = data['created_at'].dt.month
-
-            # Get the list of unique years
-            years = sorted(data['year'].unique())
-
-            # Sidebar multiselect for years
-            selected_years = st.multiselect('Select years', years, default=years)
-
-            # Filter data for selected years
-            df_selected = data[data['year'].isin(selected_years)]
-
-            # Group by year and month and count the number of tickets
-            df_counts = df_selected.groupby(['year', 'month']).size().reset_index(name='Number of Tickets')
-
-            # Pivot the data for the plot
-            df_pivot = df_counts.pivot(index='month', columns='year', values='Number of Tickets')
-
-            # Display the plot in Streamlit
-            st.bar_chart(df_pivot)
-            #####################################################################################################
+            month_chart(data, aggregate, pushdown)
 
     else:
         st.warning('Please ensure both start date and end date are selected.')
 
+profile_panel()
@@ -3,8 +3,15 @@ import plost
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from functions.filters import date_filter, optional_filters, filter_data
-from functions.variables import database_schema_variables, destination_selection
+from functions.filters import date_filter, dataset_rows, optional_filters, filter_data
+from functions.cube import filter_cube
+from functions.sketch import approximate_quantile
+from functions.leaderboard import leaderboard, leaderboard_columns, sort_leaderboard, change_page, reset_page
+from functions.aggregates import warehouse_cube, attribute_counts, wait_time_bracket_counts, ticket_medians, daily_median_wait_time, assignee_activity
+from functions.memo import page_result
+from functions.buckets import chart_granularity, bucket_dates, bucket_labels, bucket_caption
+from functions.profiling import start_profiling, page_section, profile_panel
+from functions.variables import database_schema_variables, destination_selection, pushdown_selection, aggregation_selection, approximation_selection, granularity_selection, connection_warning
 
 ## Apply standard page settings.
 st.set_page_config(
@@ -12,59 +19,137 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+## Time the page stages when profiling is switched on
+start_profiling('2_assignee_activity')
+
+## The assignee table runs as a fragment: sorting and paging only rerun the table, on the dataset
+## already filtered by the full page run.
+@st.fragment
+def assignee_table(start_date, end_date, data, filter_dict, aggregate, approximate):
+    #####################################################################################################
+    page_section('Assignee activity')
+    st.subheader('Assignee activity')
+    st.caption('Median metrics reported in hours')
+
+    sort_col, order_col, top_col = st.columns(3)
+    with sort_col:
+        sort_column = st.selectbox('Sort by', leaderboard_columns, on_change=reset_page)
+    with order_col:
+        ascending = st.selectbox('Order', ['Ascending', 'Descending'], on_change=reset_page) == 'Ascending'
+    with top_col:
+        top_k = st.selectbox('Show', ['All', 10, 25, 50, 100], on_change=reset_page)
+
+    # Per assignee stats, sorted and cached by date range, filters and sort order
+    if aggregate:
+        grouped = sort_leaderboard(assignee_activity(start_date, end_date, filter_dict), sort_column, ascending)
+    else:
+        grouped = leaderboard(start_date, end_date, data, filter_dict, sort_column, ascending, approximate)
+
+    # Keep only the top k assignees for the sort order
+    if top_k != 'All':
+        grouped = grouped.head(top_k)
+
+    rows_per_page = 10
+
+    # Calculate the number of pages
+    n_pages = (len(grouped) - 1) // rows_per_page + 1
+
+    # Create a state object to hold the current page
+    if 'page' not in st.session_state:
+        st.session_state.page = 0
+
+    # Ensure page stays within range
+    st.session_state.page = max(0, min(st.session_state.page, n_pages - 1))
+
+    # Display the current page
+    start = st.session_state.page * rows_per_page
+    end = (st.session_state.page + 1) * rows_per_page
+    st.table(grouped.iloc[start:end])
+
+    # Display prev and next buttons
+    st.button('Prev', on_click=change_page, args=(-1,))
+    st.button('Next', on_click=change_page, args=(1,))
+
 st.sidebar.header('Data Connection Variables')
 destination = destination_selection()
 database, schema = database_schema_variables()
+pushdown = pushdown_selection()
+aggregate = aggregation_selection()
+approximate = approximation_selection()
+selected_granularity = granularity_selection()
 
 st.title('Zendesk Assignee Activity')
 
-if destination in ("BigQuery","Snowflake") and (database in ("Database", "None") or schema in ("Schema", "None")):
-    st.warning('To leverage your own internal data, you will need to fork this repo and deploy as your own Streamlit app. Please see the README for additional details.')
+warning = connection_warning(destination, database, schema)
+if warning is not None:
+    st.warning(warning)
 else:
     ## Define the top level date filter
-    data, d = date_filter(dest=destination, db=database, sc=schema)
+    page_section('Filters')
+    d = date_filter(dest=destination, db=database, sc=schema)
     ## Include the optional filters as well
-    filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations, selected_assignee = optional_filters(data_ref=data, include_assignee=True)
+    filter_dict, selected_groups, selected_brands, selected_channels, selected_forms, selected_submitter_roles, selected_req_organizations, selected_assignee = optional_filters(include_assignee=True)
 
 
     ## End filter section
     st.markdown('---')
 
+    ## Load the rows once the filter bar is drawn
+    page_section('Rows')
+    data = dataset_rows(dest=destination, db=database, sc=schema, filter_dictionary=filter_dict)
+
     ## Only generate the tiles if date range is populated
     if d is not None and len(d) == 2:
         start_date, end_date = d
         if start_date is not None:
+            ## Day, week or month buckets for the date charts
+            granularity = chart_granularity(start_date, end_date, selected_granularity)
 
             ## Filter data based on filters applied
-            data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
+            page_section('Filter')
+            if aggregate:
+                daily_cube = warehouse_cube(start=start_date, end=end_date, filter_dictionary=filter_dict)
+                medians = ticket_medians(start_date, end_date, filter_dict)
+            else:
+                data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
+                daily_cube = filter_cube(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict)
+                # The chart results computed from the rows are shared with the other sessions showing the same view
+                if approximate:
+                    medians = page_result('approximate medians', data, start_date, end_date, filter_dict,
+                                          lambda: {c: round(approximate_quantile(start_date, end_date, data, filter_dict, c), 2) for c in ['requester_wait_time_in_calendar_minutes', 'first_assignment_to_resolution_calendar_minutes']})
+                else:
+                    medians = page_result('medians', data, start_date, end_date, filter_dict,
+                                          lambda: {c: data_date_filtered[c].median() for c in ['requester_wait_time_in_calendar_minutes', 'first_assignment_to_resolution_calendar_minutes']})
+            ticket_count = daily_cube['created_tickets'].sum()
 
             #####################################################################################################
             ## KPIs and Metrics
+            page_section('KPIs')
             col1, col2, col3 = st.columns(3)
             with col1:
                 st.subheader('Solved tickets')
-                ticket_unsolved_count = len(data_date_filtered.query("`status` == 'solved'"))
+                ticket_unsolved_count = int(daily_cube['solved_tickets'].sum())
                 st.metric("Count of solved tickets", ticket_unsolved_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col2:
                 st.subheader('One touch tickets')
-                one_touch_resolution_percentage = (data_date_filtered['is_one_touch_resolution'].sum() / len(data_date_filtered)) * 100
+                one_touch_resolution_percentage = (daily_cube['one_touch_tickets'].sum() / ticket_count) * 100
                 st.metric("One touch tickets percent", value=f'{one_touch_resolution_percentage:.2f}%', delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col3:
                 st.subheader('Two touch tickets')
-                two_touch_resolution_percentage = (data_date_filtered['is_two_touch_resolution'].sum() / len(data_date_filtered)) * 100
+                two_touch_resolution_percentage = (daily_cube['two_touch_tickets'].sum() / ticket_count) * 100
                 st.metric("Two touch tickets percent", value=f'{two_touch_resolution_percentage:.2f}%', delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             col4, col5 = st.columns(2)
             with col4:
                 st.subheader('Requester wait time median')
-                median_wait_time = data_date_filtered['requester_wait_time_in_calendar_minutes'].median()
+                median_wait_time = medians['requester_wait_time_in_calendar_minutes']
                 st.metric("Median Requester Wait Time", f"{median_wait_time} minutes", delta=None)
 
             with col5:
                 st.subheader('Assignment to resolution')
-                median_time = data_date_filtered['first_assignment_to_resolution_calendar_minutes'].median()
+                median_time = medians['first_assignment_to_resolution_calendar_minutes']
                 st.metric(label="Median time from first assignment to full resolution", value=f'{median_time} minutes', delta=None)
             #####################################################################################################
 
@@ -73,15 +158,17 @@ else:
             #####################################################################################################
             col1, col2 = st.columns(2)
             with col1:
+                page_section('Good vs bad satisfaction tickets')
                 st.subheader('Good vs bad satisfaction tickets')
-                satisfaction_data = data_date_filtered.copy()
-                satisfaction_data = satisfaction_data.dropna(subset=['ticket_satisfaction_score'])
-
                 # Calculate the counts of each satisfaction score
-                satisfaction_counts = satisfaction_data['ticket_satisfaction_score'].value_counts()
+                if aggregate:
+                    satisfaction_counts = attribute_counts(start_date, end_date, filter_dict, 'ticket_satisfaction_score')
+                else:
+                    satisfaction_counts = page_result('tickets by satisfaction', data, start_date, end_date, filter_dict, lambda: data_date_filtered['ticket_satisfaction_score'].dropna().value_counts())
+                satisfaction_counts = satisfaction_counts[satisfaction_counts > 0]
                 
                 # Convert counts to percentages
-                satisfaction_percentages = (satisfaction_counts / satisfaction_data['ticket_satisfaction_score'].count() * 100).round(2)
+                satisfaction_percentages = (satisfaction_counts / satisfaction_counts.sum() * 100).round(2)
                 satisfaction_percentages = satisfaction_percentages.reset_index().rename(columns={'index':'Satisfaction Score', 'count':'percent'})
                 satisfaction_percentages = satisfaction_percentages.reset_index().rename(columns={'index':'Satisfaction Score', 'ticket_satisfaction_score':'rating'})
 
@@ -93,17 +180,20 @@ else:
                 )
 
             with col2:
+                page_section('Tickets by requester wait time brackets')
                 st.subheader('Tickets by requester wait time brackets')
-                adj_date_filter = data_date_filtered.copy()
-                adj_date_filter['requester_wait_time_in_calendar_minutes'] = pd.cut(adj_date_filter['requester_wait_time_in_calendar_minutes'], 
-                                                                bins=[0, 60, np.inf], 
-                                                                labels=['0-1 hours', '>7 hours'])
-
                 # Count the number of tickets in each category
-                wait_time_counts = adj_date_filter['requester_wait_time_in_calendar_minutes'].value_counts()
+                if aggregate:
+                    wait_time_counts, ticket_total = wait_time_bracket_counts(start_date, end_date, filter_dict, bins=[0, 60, np.inf], labels=['0-1 hours', '>7 hours'])
+                else:
+                    wait_time_counts = page_result('tickets by wait time bracket', data, start_date, end_date, filter_dict,
+                                                   lambda: pd.cut(data_date_filtered['requester_wait_time_in_calendar_minutes'], 
+                                                                  bins=[0, 60, np.inf], 
+                                                                  labels=['0-1 hours', '>7 hours']).value_counts())
+                    ticket_total = len(data_date_filtered)
 
                 # Calculate the percentages
-                wait_time_percentages = (wait_time_counts / len(adj_date_filter) * 100).round(2)
+                wait_time_percentages = (wait_time_counts / ticket_total * 100).round(2)
 
                 # Convert to DataFrame for easier plotting
                 df_wait_time = pd.DataFrame({'Category': wait_time_percentages.index, 
@@ -116,20 +206,28 @@ else:
             st.markdown('---')
 
             #####################################################################################################
+            page_section('Created tickets and median requester wait time by date')
             st.subheader('Created tickets and median requester wait time by date')
-
-            grouped_data = data_date_filtered.copy()
-            grouped_data['created_at'] = pd.to_datetime(grouped_data['created_at']).dt.tz_localize(None).dt.date
-            grouped_data['requester_wait_time_in_calendar_minutes'] = pd.to_numeric(grouped_data['requester_wait_time_in_calendar_minutes'], errors='coerce')
-
-            # Group by date and calculate median requester wait time and ticket counts
-            df_grouped = grouped_data.groupby('created_at').agg({'requester_wait_time_in_calendar_minutes': 'median', 
-                                                                        'ticket_id': 'count'}).reset_index()
+            bucket_caption(granularity)
+
+            # Group by date (or week or month) and calculate median requester wait time and ticket counts
+            if aggregate:
+                df_grouped = daily_median_wait_time(start_date, end_date, filter_dict, granularity)
+            elif approximate:
+                df_grouped = page_result('approximate median wait time by date', data, start_date, end_date, filter_dict, lambda: pd.DataFrame({
+                    'requester_wait_time_in_calendar_minutes': approximate_quantile(start_date, end_date, data, filter_dict, 'requester_wait_time_in_calendar_minutes', by='created_at', granularity=granularity).round(2),
+                    'ticket_id': daily_cube.groupby(bucket_dates(daily_cube['created_at'], granularity))['created_tickets'].sum()
+                }).rename_axis('created_at').reset_index(), params=(granularity,))
+            else:
+                df_grouped = page_result('median wait time by date', data, start_date, end_date, filter_dict,
+                                         lambda: data_date_filtered.groupby(bucket_dates(data_date_filtered['created_at'], granularity)).agg({'requester_wait_time_in_calendar_minutes': 'median', 
+                                                                                                                                              'ticket_id': 'count'}).reset_index(),
+                                         params=(granularity,))
             # Rename columns for clarity
-            df_grouped.rename(columns={'requester_wait_time_in_calendar_minutes': 'Median Wait Time', 'ticket_id': 'Number of Tickets'}, inplace=True)
+            df_grouped = df_grouped.rename(columns={'requester_wait_time_in_calendar_minutes': 'Median Wait Time', 'ticket_id': 'Number of Tickets'})
 
             # Convert the dates to string format for better display in Streamlit
-            df_grouped['created_at'] = df_grouped['created_at'].apply(lambda x: x.strftime('%m-%d'))
+            df_grouped['created_at'] = bucket_labels(df_grouped['created_at'], granularity, '%m-%d')
             
             # Create the bar chart in Streamlit
             plost.bar_chart(
@@ -143,47 +241,9 @@ else:
 
             st.markdown('---')
 
-            #####################################################################################################
-            st.subheader('Assignee activity')
-            st.caption('Median metrics reported in hours')
-
-            table_data = data_date_filtered.copy()
-            table_data['requester_wait_time_in_calendar_minutes'] = pd.to_numeric(table_data['requester_wait_time_in_calendar_minutes'], errors='coerce')
-
-            # Group by assignee_name and calculate metrics
-            grouped = table_data.groupby('assignee_name').agg(
-                solved_tickets_count=pd.NamedAgg(column='status', aggfunc=lambda x: (x == 'solved').sum()),
-                first_reply_time_median=pd.NamedAgg(column='first_reply_time_calendar_minutes', aggfunc=lambda x: round(x.median() / 60, 2)),
-                requester_wait_time_median=pd.NamedAgg(column='requester_wait_time_in_calendar_minutes', aggfunc=lambda x: round(x.median() / 60, 2)),
-                last_assignment_resolution_time_median=pd.NamedAgg(column='last_assignment_to_resolution_calendar_minutes', aggfunc=lambda x: round(x.median() / 60, 2)),
-                final_resolution_time_median=pd.NamedAgg(column='final_resolution_calendar_minutes', aggfunc=lambda x: round(x.median() / 60, 2))
-            )
-
-            # Reset the index to make 'assignee_name' a column in the DataFrame
-            grouped.reset_index(inplace=True)
-
-            rows_per_page = 10
-
-            # Calculate the number of pages
-            n_pages = (len(grouped) - 1) // rows_per_page + 1
-
-            # Create a state object to hold the current page
-            if 'page' not in st.session_state:
-                st.session_state.page = 0
-
-            # Display the current page
-            start = st.session_state.page * rows_per_page
-            end = (st.session_state.page + 1) * rows_per_page
-            st.table(grouped.iloc[start:end])
-
-            # Display prev and next buttons
-            if st.button('Prev'):
-                st.session_state.page -= 1
-            if st.button('Next'):
-                st.session_state.page += 1
-
-            # Ensure page stays within range
-            st.session_state.page = max(0, min(st.session_state.page, n_pages - 1))
+            assignee_table(start_date, end_date, data, filter_dict, aggregate, approximate)
 
     else:
         st.warning('Please ensure both start date and end date are selected.')
+
+profile_panel()
@@ -3,8 +3,13 @@ import plost
 import pandas as pd
 import numpy as np
 from functions.filters import date_filter
-from functions.filters import date_filter, sla_optional_filters, filter_data
-from functions.variables import database_schema_variables, destination_selection
+from functions.filters import date_filter, dataset_rows, sla_optional_filters, filter_data
+from functions.cube import filter_cube
+from functions.aggregates import warehouse_cube, hourly_counts, weekday_counts, sla_ticket_counts
+from functions.memo import page_result
+from functions.buckets import chart_granularity, bucket_dates, bucket_labels, bucket_caption
+from functions.profiling import start_profiling, page_section, profile_panel
+from functions.variables import database_schema_variables, destination_selection, pushdown_selection, aggregation_selection, granularity_selection, connection_warning
 
 ## Apply standard page settings.
 st.set_page_config(
@@ -12,66 +17,181 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+## Time the page stages when profiling is switched on
+start_profiling('3_sla_policies')
+
+## The drill down charts run as a fragment: changing the attribute only reruns them, on the cube by day
+## and the selected attribute.
+## The chart results computed from the rows are shared with the other sessions showing the same view.
+@st.fragment
+def attribute_charts(start_date, end_date, filter_dict, data, aggregate):
+    #####################################################################################################
+    ## Bar chart: Achieved and breached completed SLA policies by selected attribute (top 10 breached):
+
+
+    page_section('Achieved SLA Policies, top 10')
+    st.subheader('Achieved SLA Policies, top 10')
+    option = st.selectbox(
+        'Please select an attribute to drill down',
+        ('sla_policy_name', 'ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group')
+    ) 
+
+    option_to_value = {
+        'sla_policy_name': 'Value for sla_policy_name',
+        'ticket_brand': 'Value for ticket_brand',
+        'ticket_channel': 'Value for ticket_channel',
+        'ticket_form': 'Value for ticket_form',
+        'ticket_group': 'Value for ticket_group',
+        'ticket_priority': 'Value for ticket_priority',
+        'ticket_type': 'Value for ticket_type'
+    }
+
+    # The cube by day and the selected attribute, summed in the warehouse in aggregate mode
+    if aggregate:
+        option_cube = warehouse_cube(start=start_date, end=end_date, filter_dictionary=filter_dict, model="sla", dimensions=[option])
+    else:
+        option_cube = filter_cube(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict, model="sla", dimensions=[option])
+
+    # Count the completed achieved SLAs for each unique value of the selected attribute
+    achieved_ticket_count = page_result('achieved slas by attribute', data, start_date, end_date, filter_dict, lambda: option_cube.groupby(option, observed=True)['completed_achieved_slas'].sum().rename('count'), params=(option,), model='sla')
+    achieved_ticket_count = achieved_ticket_count[achieved_ticket_count > 0]
+
+    # Keep only the top 10 values
+    top_attributes = achieved_ticket_count.nlargest(10)
+
+    # Create a bar chart for achieved SLAs
+    st.bar_chart(top_attributes, use_container_width=True)
+
+    page_section('Breached SLA Policies, top 10')
+    st.subheader('Breached SLA Policies, top 10')
+    # Count the completed breached SLAs for each unique value of the selected attribute
+    attribute_counts = page_result('breached slas by attribute', data, start_date, end_date, filter_dict, lambda: option_cube.groupby(option, observed=True)['completed_breached_slas'].sum().rename('count'), params=(option,), model='sla')
+    attribute_counts = attribute_counts[attribute_counts > 0]
+
+    # Keep only the top 10 values
+    top_attributes = attribute_counts.nlargest(10)
+
+    # Create a bar chart for breached SLAs
+    st.bar_chart(top_attributes, use_container_width=True)
+
+    # st.subheader('Achieved and Breached SLA Policies, top 10')
+    # options = st.selectbox(
+    #     'Please select an attribute',
+    #     ('sla_policy_name', 'ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group')
+    # )
+
+    # att_data = data_date_filtered.copy()
+    # # Create DataFrames for achieved and breached SLAs
+    # achieved_slas = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 0)]
+    # breached_slas = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 1)]
+
+    # # Count unique ticket IDs for achieved and breached SLAs
+    # achieved_ticket_counts = achieved_slas['ticket_id'].nunique()
+    # breached_ticket_counts = breached_slas['ticket_id'].nunique()
+
+    # achieved_attribute_counts = achieved_slas[options].value_counts()
+    # breached_attribute_counts = breached_slas[options].value_counts()
+
+    # top_achieved_attributes = achieved_attribute_counts.nlargest(10).reset_index()
+    # top_breached_attributes = breached_attribute_counts.nlargest(10).reset_index()
+
+    # # Create DataFrames for visualization
+    # data_to_visualize = pd.DataFrame({
+    #     'Category': ['Achieved SLAs'] * 10 + ['Breached SLAs'] * 10,
+    #     'Attribute': top_achieved_attributes['index'].tolist() + top_breached_attributes['index'].tolist(),
+    #     'Count': top_achieved_attributes[option].tolist() + top_breached_attributes[option].tolist()
+    # })
+
+    # # Create a bar chart using Streamlit
+    # st.bar_chart(data_to_visualize, use_container_width=True)
+    #####################################################################################################
+
 st.sidebar.header('Data Connection Variables')
 destination = destination_selection()
 database, schema = database_schema_variables()
+pushdown = pushdown_selection()
+aggregate = aggregation_selection()
+selected_granularity = granularity_selection()
 
 st.title('Zendesk SLA Policies')
 
 
-if destination in ("BigQuery","Snowflake") and (database in ("Database", "None") or schema in ("Schema", "None")):
-    st.warning('To leverage your own internal data, you will need to fork this repo and deploy as your own Streamlit app. Please see the README for additional details.')
+warning = connection_warning(destination, database, schema)
+if warning is not None:
+    st.warning(warning)
 else:
     ## Define the top level date filter
-    data, d = date_filter(dest=destination, db=database, sc=schema, md="sla")
+    page_section('Filters')
+    d = date_filter(dest=destination, db=database, sc=schema, md="sla")
 
-    filter_dict, selected_sla_name, selected_metric, selected_group, selected_req_organizations, selected_req_organizations, selected_forms = sla_optional_filters(data_ref=data)
+    filter_dict, selected_sla_name, selected_metric, selected_group, selected_req_organizations, selected_req_organizations, selected_forms = sla_optional_filters()
     ## End filter section
     st.markdown('---')
 
+    ## Load the rows once the filter bar is drawn
+    page_section('Rows')
+    data = dataset_rows(dest=destination, db=database, sc=schema, md="sla", filter_dictionary=filter_dict)
+
     ## Only generate the tiles if date range is populated
     if d is not None and len(d) == 2:
         start_date, end_date = d
         if start_date is not None:
+            ## Day, week or month buckets for the date charts
+            granularity = chart_granularity(start_date, end_date, selected_granularity)
 
             ## Filter data based on filters applied
-            data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict, model="sla")
+            page_section('Filter')
+            if aggregate:
+                daily_cube = warehouse_cube(start=start_date, end=end_date, filter_dictionary=filter_dict, model="sla")
+                ticket_counts = sla_ticket_counts(start_date, end_date, filter_dict)
+            else:
+                data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict, model="sla")
+                daily_cube = filter_cube(start=start_date, end=end_date, data_ref=data, filter_dictionary=filter_dict, model="sla")
 
             #####################################################################################################
             ## KPIs and Metrics
+            page_section('KPIs')
             col1, col2, col3 = st.columns(3)
             with col1:
                 st.subheader('SLA achievement rate')
-                sla_achieved_count = len(data_date_filtered.query("`is_sla_breach` == 0"))
-                total_sla_count = data_date_filtered['sla_event_id'].nunique()  # Calculate the total number of distinct sla IDs
+                sla_achieved_count = daily_cube['achieved_slas'].sum()
+                total_sla_count = daily_cube['sla_events'].sum()  # sla_event_id is unique, so this is the number of distinct sla IDs
                 sla_achievement_rate = (sla_achieved_count / total_sla_count) * 100
                 st.metric("SLA achievement rate",  value=f'{sla_achievement_rate:.2f}%', delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col2:
                 st.subheader('SLA breached tickets')
-                # Filter data_date_filtered to select rows where 'is_sla_breach' is True (1).
-                breached_tickets = data_date_filtered[data_date_filtered['is_sla_breach'] == 1]
-                # Calculate the total count of unique ticket IDs for SLA breached tickets.
-                breached_ticket_count = breached_tickets['ticket_id'].nunique()
+                if aggregate:
+                    breached_ticket_count = int(ticket_counts['breached_tickets'])
+                else:
+                    # Filter data_date_filtered to select rows where 'is_sla_breach' is True (1), and
+                    # calculate the total count of unique ticket IDs for SLA breached tickets.
+                    breached_ticket_count = page_result('breached tickets', data, start_date, end_date, filter_dict, lambda: data_date_filtered.loc[data_date_filtered['is_sla_breach'] == 1, 'ticket_id'].nunique(), model='sla')
                 st.metric("SLA breached tickets", breached_ticket_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col3:
                 st.subheader('SLA achieved tickets')
-                achieved_tickets = data_date_filtered[data_date_filtered['is_sla_breach'] == 0]
-                achieved_ticket_count = achieved_tickets['ticket_id'].nunique()
+                if aggregate:
+                    achieved_ticket_count = int(ticket_counts['achieved_tickets'])
+                else:
+                    achieved_ticket_count = page_result('achieved tickets', data, start_date, end_date, filter_dict, lambda: data_date_filtered.loc[data_date_filtered['is_sla_breach'] == 0, 'ticket_id'].nunique(), model='sla')
                 st.metric("SLA achieved tickets", achieved_ticket_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             col4, col5 = st.columns(2)
             with col4:
                 st.subheader('SLA active tickets')
-                active_tickets = data_date_filtered[data_date_filtered['is_active_sla'] == 0]
-                active_ticket_count = active_tickets['ticket_id'].nunique()
+                if aggregate:
+                    active_ticket_count = int(ticket_counts['active_tickets'])
+                else:
+                    active_ticket_count = page_result('active tickets', data, start_date, end_date, filter_dict, lambda: data_date_filtered.loc[data_date_filtered['is_active_sla'] == 0, 'ticket_id'].nunique(), model='sla')
                 st.metric("SLA active tickets", active_ticket_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             with col5:
                 st.subheader('SLA active breached tickets')
-                active_breached_tickets = data_date_filtered[(data_date_filtered['is_sla_breach'] == 1) & (data_date_filtered['is_active_sla'] == 0)]
-                active_ticket_count = active_breached_tickets['ticket_id'].nunique() 
+                if aggregate:
+                    active_ticket_count = int(ticket_counts['active_breached_tickets'])
+                else:
+                    active_ticket_count = page_result('active breached tickets', data, start_date, end_date, filter_dict, lambda: data_date_filtered.loc[(data_date_filtered['is_sla_breach'] == 1) & (data_date_filtered['is_active_sla'] == 0), 'ticket_id'].nunique(), model='sla')
                 st.metric("SLA active tickets", active_ticket_count, delta=None, delta_color="normal", help=None, label_visibility="visible")
 
             #####################################################################################################
@@ -80,29 +200,24 @@ else:
 
             #################################################################################################### 
             # Create an area chart using st.area_chart.
+            page_section('Achieved vs. breached completed SLA policies')
             st.subheader('Achieved vs. breached completed SLA policies')
-            sla_policies_date = data_date_filtered.copy()
-
-            # Convert 'sla_applied_at' to datetime, make them timezone naive, and extract date
-            sla_policies_date['sla_applied_at'] = sla_policies_date['sla_applied_at'].dt.date
-            
-            # Filter and count achieved and breached SLAs
-            completed_slas = sla_policies_date[sla_policies_date['is_active_sla'] == 0]
-            breached_slas = completed_slas[completed_slas['is_sla_breach'] == 1]
-            achieved_slas = completed_slas[completed_slas['is_sla_breach'] == 0]
+            bucket_caption(granularity)
 
-            # Group and count achieved and breached SLAs by date
-            breached_counts = breached_slas.groupby('sla_applied_at').size()
-            achieved_counts = achieved_slas.groupby('sla_applied_at').size()
+            # Sum the completed achieved and breached SLAs of the daily cube cells by date (or week or month)
+            combined_counts = page_result('completed slas by date', data, start_date, end_date, filter_dict,
+                                          lambda: daily_cube.groupby(bucket_dates(daily_cube['sla_applied_at'], granularity))[['completed_breached_slas', 'completed_achieved_slas']].sum(),
+                                          params=(granularity,), model='sla')
+            combined_counts = combined_counts.set_axis(['Breached SLAs', 'Achieved SLAs'], axis=1)
 
-            # Merge the counts into a single DataFrame
-            combined_counts = pd.DataFrame({'Breached SLAs': breached_counts, 'Achieved SLAs': achieved_counts}).fillna(0)
+            # Only keep dates with completed SLAs
+            combined_counts = combined_counts[combined_counts.sum(axis=1) > 0]
 
             # Reset the index to make 'sla_applied_at' a column in the DataFrame
-            combined_counts.reset_index(inplace=True)
+            combined_counts = combined_counts.reset_index()
 
-            # Convert the dates to string in 'YYYY-MM-DD' format
-            combined_counts['sla_applied_at'] = combined_counts['sla_applied_at'].apply(lambda x: x.strftime('%m-%d'))
+            # Convert the dates to string in 'MM-DD' format
+            combined_counts['sla_applied_at'] = bucket_labels(combined_counts['sla_applied_at'], granularity, '%m-%d')
 
             # Create an area chart with Streamlit
             plost.area_chart(
@@ -113,93 +228,17 @@ else:
             )
             #####################################################################################################
 
-            #####################################################################################################
-            ## Bar chart: Achieved and breached completed SLA policies by selected attribute (top 10 breached):
-            
-            
-            st.subheader('Achieved SLA Policies, top 10')
-            option = st.selectbox(
-                'Please select an attribute to drill down',
-                ('sla_policy_name', 'ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group')
-            ) 
-
-            option_to_value = {
-                'sla_policy_name': 'Value for sla_policy_name',
-                'ticket_brand': 'Value for ticket_brand',
-                'ticket_channel': 'Value for ticket_channel',
-                'ticket_form': 'Value for ticket_form',
-                'ticket_group': 'Value for ticket_group',
-                'ticket_priority': 'Value for ticket_priority',
-                'ticket_type': 'Value for ticket_type'
-            }
-
-            # Filter data based on the selected attribute and is_active_sla
-            att_data = data_date_filtered.copy()
-            filtered_data = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 0)]
-
-            # Count the number of occurrences of each unique value for the selected attribute
-            achieved_ticket_count = filtered_data[option].value_counts()
-
-            # Keep only the top 10 values
-            top_attributes = achieved_ticket_count.nlargest(10)
-
-            # Create a bar chart for achieved SLAs
-            st.bar_chart(top_attributes, use_container_width=True)
-
-            st.subheader('Breached SLA Policies, top 10')
-            # Filter data based on the selected attribute and is_active_sla
-            filtered_data = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 1)]
-
-            # Count the number of occurrences of each unique value for the selected attribute
-            attribute_counts = filtered_data[option].value_counts()
-
-            # Keep only the top 10 values
-            top_attributes = attribute_counts.nlargest(10)
-
-            # Create a bar chart for breached SLAs
-            st.bar_chart(top_attributes, use_container_width=True)
-
-            # st.subheader('Achieved and Breached SLA Policies, top 10')
-            # options = st.selectbox(
-            #     'Please select an attribute',
-            #     ('sla_policy_name', 'ticket_brand', 'ticket_channel', 'ticket_form', 'ticket_group')
-            # )
-            
-            # att_data = data_date_filtered.copy()
-            # # Create DataFrames for achieved and breached SLAs
-            # achieved_slas = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 0)]
-            # breached_slas = att_data[(att_data['is_active_sla'] == 0) & (att_data['is_sla_breach'] == 1)]
- 
-            # # Count unique ticket IDs for achieved and breached SLAs
-            # achieved_ticket_counts = achieved_slas['ticket_id'].nunique()
-            # breached_ticket_counts = breached_slas['ticket_id'].nunique()
-
-            # achieved_attribute_counts = achieved_slas[options].value_counts()
-            # breached_attribute_counts = breached_slas[options].value_counts()
-
-            # top_achieved_attributes = achieved_attribute_counts.nlargest(10).reset_index()
-            # top_breached_attributes = breached_attribute_counts.nlargest(10).reset_index()
-            
-            # # Create DataFrames for visualization
-            # data_to_visualize = pd.DataFrame({
-            #     'Category': ['Achieved SLAs'] * 10 + ['Breached SLAs'] * 10,
-            #     'Attribute': top_achieved_attributes['index'].tolist() + top_breached_attributes['index'].tolist(),
-            #     'Count': top_achieved_attributes[option].tolist() + top_breached_attributes[option].tolist()
-            # })
-            
-            # # Create a bar chart using Streamlit
-            # st.bar_chart(data_to_visualize, use_container_width=True)
-            #####################################################################################################
+            attribute_charts(start_date, end_date, filter_dict, data, aggregate)
 
             #####################################################################################################
             ## Line chart: SLA target breaches by hour of day
+            page_section('SLA target breaches by hour of day')
             st.subheader('SLA target breaches by hour of day')
-            sla_breaches_by_hour_data = data_date_filtered.copy()
-
-            sla_breaches_by_hour_data['sla_breach_at'] = pd.to_datetime(sla_breaches_by_hour_data['sla_breach_at'])
-            sla_breaches_by_hour_data['hour'] = sla_breaches_by_hour_data['sla_breach_at'].dt.hour
-            # Count the number of tickets created each hour
-            hourly_slas = sla_breaches_by_hour_data.groupby('hour')['sla_event_id'].count()
+            # Count the number of SLA breaches each hour
+            if aggregate:
+                hourly_slas = hourly_counts(start_date, end_date, filter_dict, model="sla")
+            else:
+                hourly_slas = page_result('breaches by hour', data, start_date, end_date, filter_dict, lambda: data_date_filtered.groupby('breach_hour')['sla_event_id'].count().rename_axis('hour'), model='sla')
             # Calculate the percentage
             total_slas = hourly_slas.sum()
             hourly_percentage = ((hourly_slas / total_slas) * 100).round(2)
@@ -211,18 +250,18 @@ else:
 
             #####################################################################################################
             ## Bar chart: SLA target breaches by day of week
+            page_section('SLA target breaches by day of week')
             st.subheader('SLA target breaches by day of week')
-            sla_breaches_by_day_week = data_date_filtered.copy()
 
-            # Convert 'created_at' to datetime and extract day of week if it's not already in that format
-            sla_breaches_by_day_week['sla_breach_at'] = pd.to_datetime(sla_breaches_by_day_week['sla_breach_at'])
-            sla_breaches_by_day_week['day_of_week'] = sla_breaches_by_day_week['sla_breach_at'].dt.dayofweek
-
-            # Count the number of tickets created each day of the week
-            daily_breaches = sla_breaches_by_day_week.groupby('day_of_week')['ticket_id'].count()
+            # Count the number of SLA breaches each day of the week
+            if aggregate:
+                daily_breaches = weekday_counts(start_date, end_date, filter_dict, model="sla")
+                total_days = int(ticket_counts['breach_days'])
+            else:
+                daily_breaches = page_result('breaches by weekday', data, start_date, end_date, filter_dict, lambda: data_date_filtered.groupby('breach_weekday')['ticket_id'].count(), model='sla')
+                total_days = page_result('breach days', data, start_date, end_date, filter_dict, lambda: len(data_date_filtered['breach_date'].unique()), model='sla')
 
             # Calculate the average
-            total_days = len(sla_breaches_by_day_week['sla_breach_at'].dt.normalize().unique())
             average_daily_breaches = (daily_breaches / total_days).round(2)
 
             # Create a dictionary to map day of week numbers to names
@@ -243,3 +282,5 @@ else:
 
     else:
         st.warning('Please ensure both start date and end date are selected.')
+
+profile_panel()
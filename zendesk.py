@@ -1,9 +1,20 @@
 import streamlit as st
-from functions.variables import database_schema_variables, destination_selection
+from functions.variables import database_schema_variables, destination_selection, pushdown_selection, aggregation_selection, connection_warning
+from functions.warmup import warm_up
+from functions.tenants import tenant_admin
 
 st.sidebar.header('Data Connection Variables')
 destination = destination_selection()
 database, schema = database_schema_variables()
+pushdown = pushdown_selection()
+aggregate = aggregation_selection()
+
+# Start loading the selected connection's models in the background while the overview is read.
+if connection_warning(destination, database, schema) is None:
+    warm_up(destination, database, schema, load_rows=not (pushdown or aggregate))
+
+# Resident tenants, for operators
+tenant_admin()
 
 # Read the README contents
 with open("README.md", "r") as f: